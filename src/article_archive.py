@@ -0,0 +1,128 @@
+import json
+import gzip
+import hashlib
+import datetime as dt
+import glob
+import os
+
+
+# Format used to record when a body was archived:
+archived_format = '%Y-%m-%d %H:%M:%S'
+
+
+def body_hash(content):
+    """
+    Return the hash (str) of the bytes `content` of an article's HTTP
+    response body, used as the body's address in the archive.
+    """
+    return hashlib.sha1(content).hexdigest()
+
+
+def blob_filename(archive_path, digest):
+    """
+    Return the path of the file in the archive directory `archive_path`
+    (str) that stores the gzipped body whose hash is `digest` (str).
+    Blobs are spread over sub-directories named after the first two
+    characters of the hash.
+    """
+    return os.path.join(archive_path, 'blobs', digest[:2], digest + '.html.gz')
+
+
+def index_filename(archive_path, date):
+    """
+    Return the path of the index file in `archive_path` (str) that lists
+    the articles of the date `date` (str, '%Y-%m-%d').
+    """
+    return os.path.join(archive_path, 'index', date + '.jsonl')
+
+
+def save_blob(archive_path, content):
+    """
+    Store the bytes `content` gzipped in the archive `archive_path`,
+    unless an identical body is already there. Return its hash (str).
+    """
+    digest   = body_hash(content)
+    filename = blob_filename(archive_path, digest)
+    if os.path.isfile(filename):
+        return digest
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with gzip.open(filename + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(filename + '.tmp', filename)
+    return digest
+
+
+def load_blob(archive_path, digest):
+    """
+    Return the body (bytes) whose hash is `digest` (str) stored in the
+    archive `archive_path`.
+    """
+    with gzip.open(blob_filename(archive_path, digest), 'rb') as f:
+        return f.read()
+
+
+def archive_response(archive_path, url_file, response, now=None):
+    """
+    Store the body of the article's HTTP `response` in the archive
+    directory `archive_path` (str) and add an entry to the index of
+    the article's date, linking the article (described by the dict
+    `url_file`, with keys 'url', 'filename' and, optionally, 'date'
+    and 'secao') to the body. `now` (datetime) is the archiving time
+    (default: current time).
+
+    The text encoding used by requests to decode the body is recorded,
+    so the archived article is decoded exactly as when it was captured.
+    """
+    if now is None:
+        now = dt.datetime.now()
+    digest = save_blob(archive_path, response.content)
+
+    entry = {'url':         url_file['url'],
+             'filename':    url_file['filename'],
+             'date':        url_file.get('date', 'undated'),
+             'secao':       url_file.get('secao'),
+             'hash':        digest,
+             'encoding':    response.encoding if response.encoding != None else response.apparent_encoding,
+             'archived_at': now.strftime(archived_format)}
+
+    filename = index_filename(archive_path, entry['date'])
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+    return entry
+
+
+def load_index(archive_path, start_date=None, end_date=None):
+    """
+    Return the list of index entries (dicts) in the archive `archive_path`
+    (str) for the articles' dates between `start_date` and `end_date`
+    (str, '%Y-%m-%d', inclusive; None means no limit), sorted by date.
+    If an article was archived more than once, only its last entry is
+    returned.
+    """
+    entries = {}
+    for filename in sorted(glob.glob(os.path.join(archive_path, 'index', '*.jsonl'))):
+        date = os.path.basename(filename)[:-len('.jsonl')]
+        if start_date != None and date < start_date:
+            continue
+        if end_date != None and date > end_date:
+            continue
+        with open(filename, 'r') as f:
+            for line in f:
+                entry = json.loads(line)
+                # Keep the order of first appearance, but the last body:
+                entries[entry['url']] = entry
+
+    return list(entries.values())
+
+
+def entry_text(archive_path, entry):
+    """
+    Return the article's HTML (str) described by the index `entry`
+    (dict) stored in the archive `archive_path`, decoded as requests
+    did when it was captured.
+    """
+    content = load_blob(archive_path, entry['hash'])
+    return str(content, entry['encoding'] if entry['encoding'] != None else 'utf-8', errors='replace')
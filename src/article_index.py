@@ -0,0 +1,259 @@
+import json
+import sqlite3
+import re
+import os
+from collections import defaultdict
+import parse_dou_article as pa
+import structure_article as sa
+import filter_articles as fa
+import keyword_matcher as km
+
+
+# Structured articles' fields (see structure_article) searchable in the index:
+indexed_columns = ['secao', 'orgao', 'assina', 'identifica', 'cargo', 'ementa', 'alltext', 'fulltext']
+
+# Sub-directories of storage_path (see write_article.write_local_article) named after a date:
+date_dir = re.compile(r'^(capt_)?(\d{4}-\d{2}-\d{2})$')
+
+
+def open_index(index_path):
+    """
+    Open (creating it if needed) the SQLite database `index_path` (str)
+    that indexes the articles saved locally and return the connection.
+
+    The normalized text (see keyword_matcher.normalize) of the articles'
+    `indexed_columns` is indexed by trigrams (SQLite FTS5), so any keyword
+    with at least 3 characters can be looked up, and the structured
+    articles are stored for the exact evaluation of the filters.
+    """
+    conn = sqlite3.connect(index_path)
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS text_index USING fts5(" + ', '.join(indexed_columns) +
+                     ", content='', tokenize='trigram')")
+    except sqlite3.OperationalError:
+        conn.close()
+        raise Exception('open_index: SQLite ' + sqlite3.sqlite_version + ' has no FTS5 trigram tokenizer (3.34 or newer is needed).')
+    conn.execute('CREATE TABLE IF NOT EXISTS articles (docid INTEGER PRIMARY KEY, path TEXT UNIQUE, '
+                 'pub_date TEXT, mtime REAL, size INTEGER, article TEXT)')
+    conn.execute('CREATE INDEX IF NOT EXISTS articles_pub_date ON articles (pub_date)')
+    # Files that could not be indexed (as they were when that was tried):
+    conn.execute('CREATE TABLE IF NOT EXISTS failures (path TEXT PRIMARY KEY, pub_date TEXT, mtime REAL, size INTEGER, error TEXT)')
+    return conn
+
+
+def open_config_index(config):
+    """
+    Open the index (see open_index) of the articles saved in
+    config['storage_path'], stored in config['article_index_path']
+    (default: article_index.sqlite inside storage_path).
+    """
+    return open_index(config.get('article_index_path', os.path.join(config['storage_path'], 'article_index.sqlite')))
+
+
+def read_local_article(filename):
+    """
+    Load the article saved by write_article.write_local_article in
+    `filename` (str) and return it structured (dict, see
+    structure_article), or None if it is empty.
+    """
+    with open(filename, 'r') as f:
+        rows = json.load(f)
+    if len(rows) == 0:
+        return None
+    raw_article = pa.RawArticle({row['key']: row['value'] for row in rows},
+                                rows[0]['url'], rows[0]['capture_date'], rows[0]['url_certificado'])
+    return sa.structure_article(raw_article)
+
+
+def indexed_values(article):
+    """
+    Return the list of normalized values (str) of the `indexed_columns`
+    of the structured `article` (dict).
+    """
+    return [km.normalize(article[column]) if article.get(column) != None else None for column in indexed_columns]
+
+
+def remove_article(conn, docid, article_json):
+    """
+    Remove from the index `conn` the article `docid` (int), whose stored
+    structured article is `article_json` (str).
+    """
+    # Contentless FTS5 tables need the indexed values to delete a row:
+    conn.execute("INSERT INTO text_index (text_index, rowid, " + ', '.join(indexed_columns) + ") VALUES ('delete', ?" +
+                 ', ?' * len(indexed_columns) + ")", [docid] + indexed_values(json.loads(article_json)))
+    conn.execute('DELETE FROM articles WHERE docid = ?', (docid,))
+
+
+def update_index(conn, storage_path, start_date=None, end_date=None):
+    """
+    Bring the index `conn` up to date with the articles saved in the
+    sub-directories of `storage_path` (str) named after the publication
+    dates between `start_date` and `end_date` (str, '%Y-%m-%d', inclusive;
+    None means no limit): new and modified files are (re)indexed and
+    removed files (or sub-directories) are dropped from the index. Files 
+    that cannot be read are recorded and only tried again once they change.
+    Return a dict with the number of articles added, updated, removed and
+    unchanged and of files that failed.
+    """
+    counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+    dates  = [start_date or '0000-00-00', end_date or '9999-99-99']
+
+    # Dated sub-directories in the period:
+    dirs = []
+    for name in sorted(os.listdir(storage_path)):
+        match = date_dir.match(name)
+        if match is None or not os.path.isdir(os.path.join(storage_path, name)):
+            continue
+        date = match.group(2)
+        if dates[0] <= date <= dates[1]:
+            dirs.append((os.path.join(storage_path, name), date))
+
+    # Articles and failures in sub-directories of the period that no longer exist:
+    existing = set([path for path, date in dirs])
+    for row in list(conn.execute('SELECT docid, path FROM articles WHERE pub_date BETWEEN ? AND ?', dates)):
+        if os.path.dirname(row[1]) not in existing:
+            remove_article(conn, row[0], conn.execute('SELECT article FROM articles WHERE docid = ?', (row[0],)).fetchone()[0])
+            counts['removed'] = counts['removed'] + 1
+    for row in list(conn.execute('SELECT path FROM failures WHERE pub_date BETWEEN ? AND ?', dates)):
+        if os.path.dirname(row[0]) not in existing:
+            conn.execute('DELETE FROM failures WHERE path = ?', row)
+
+    for path, date in dirs:
+        # Indexed files in this sub-directory:
+        prefix  = os.path.join(path, '')
+        indexed = {row[0]: row[1:] for row in conn.execute('SELECT path, docid, mtime, size, article FROM articles '
+                                                           'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+        failed  = {row[0]: row[1:] for row in conn.execute('SELECT path, mtime, size FROM failures '
+                                                           'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+        for filename in sorted(os.listdir(path)):
+            filename = os.path.join(path, filename)
+            stat     = os.stat(filename)
+            entry    = indexed.pop(filename, None)
+            if entry != None and entry[1] == stat.st_mtime and entry[2] == stat.st_size:
+                counts['unchanged'] = counts['unchanged'] + 1
+                continue
+            if failed.pop(filename, None) == (stat.st_mtime, stat.st_size):
+                counts['failed'] = counts['failed'] + 1
+                continue
+
+            try:
+                article = read_local_article(filename)
+                error   = None if article != None else 'empty article'
+            except Exception as e:
+                article = None
+                error   = repr(e)
+            if entry != None:
+                remove_article(conn, entry[0], entry[3])
+            if error != None:
+                print('Could not index ' + filename + ': ' + error)
+                conn.execute('INSERT OR REPLACE INTO failures (path, pub_date, mtime, size, error) VALUES (?, ?, ?, ?, ?)',
+                             (filename, date, stat.st_mtime, stat.st_size, error))
+                counts['failed'] = counts['failed'] + 1
+                continue
+            conn.execute('DELETE FROM failures WHERE path = ?', (filename,))
+
+            article_json = json.dumps(article)
+            docid = conn.execute('INSERT INTO articles (path, pub_date, mtime, size, article) VALUES (?, ?, ?, ?, ?)',
+                                 (filename, date, stat.st_mtime, stat.st_size, article_json)).lastrowid
+            conn.execute("INSERT INTO text_index (rowid, " + ', '.join(indexed_columns) + ") VALUES (?" +
+                         ', ?' * len(indexed_columns) + ")", [docid] + indexed_values(article))
+            key = 'added' if entry is None else 'updated'
+            counts[key] = counts[key] + 1
+
+        # Files that no longer exist:
+        for filename, entry in indexed.items():
+            remove_article(conn, entry[0], entry[3])
+            counts['removed'] = counts['removed'] + 1
+        for filename in failed.keys():
+            conn.execute('DELETE FROM failures WHERE path = ?', (filename,))
+
+    conn.commit()
+    return counts
+
+
+def fts_phrase(keyword):
+    """
+    Return the FTS5 query string (str) that matches the `keyword` (str).
+    """
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def candidates_query(bot_info):
+    """
+    Return an FTS5 query (str) that matches (at least) all indexed
+    articles that the filter set `bot_info` (dict, see
+    filter_articles.format_filters) can select, or None if the index
+    cannot narrow them down (e.g. when the filter set only has keywords
+    with less than 3 characters, too short for trigrams).
+
+    Only positive filters over the `indexed_columns` are used: any
+    keyword of a filter must be present (as normalized text, which
+    contains every match made ignoring case only) and all filters
+    must be satisfied.
+    """
+    clauses = []
+    for f in bot_info['filters']:
+        if f['column_name'] not in indexed_columns or 'positive_filter' not in f.keys():
+            continue
+        keywords = [km.normalize(var) for var in f['positive_filter']]
+        if len(keywords) == 0 or min([len(k) for k in keywords]) < 3:
+            continue
+        clauses.append(f['column_name'] + ' : (' + ' OR '.join([fts_phrase(k) for k in sorted(set(keywords))]) + ')')
+
+    if len(clauses) == 0:
+        return None
+    return ' AND '.join(clauses)
+
+
+def candidate_docids(conn, bot_info, start_date=None, end_date=None):
+    """
+    Return the set of ids (int) of the indexed articles published between
+    `start_date` and `end_date` (str, '%Y-%m-%d', inclusive; None means
+    no limit) that the filter set `bot_info` can select (see
+    candidates_query).
+    """
+    query = candidates_query(bot_info)
+    dates = [start_date or '0000-00-00', end_date or '9999-99-99']
+    if query is None:
+        rows = conn.execute('SELECT docid FROM articles WHERE pub_date BETWEEN ? AND ?', dates)
+    else:
+        rows = conn.execute('SELECT articles.docid FROM text_index JOIN articles ON articles.docid = text_index.rowid '
+                            'WHERE text_index MATCH ? AND articles.pub_date BETWEEN ? AND ?', [query] + dates)
+    return set([row[0] for row in rows])
+
+
+def evaluate_filters(conn, bot_infos, start_date=None, end_date=None):
+    """
+    Return, for each filter set in `bot_infos` (list of dicts, see
+    filter_articles.format_filters), a dict with the number of candidate
+    articles found by the index `conn` among those published between
+    `start_date` and `end_date` (key 'candidates') and the list of
+    structured articles the filter set selects (key 'articles', sorted by
+    publication date). Each candidate is verified with the filters' exact
+    semantics (see filter_articles.FilterPlan), only by the filter sets it
+    is a candidate for.
+    """
+    candidates = [candidate_docids(conn, bot_info, start_date, end_date) for bot_info in bot_infos]
+    
+    # Group the candidate articles by the filter sets they are candidates for:
+    groups = defaultdict(list)
+    for docid in sorted(set().union(*candidates)):
+        groups[tuple([i for i, c in enumerate(candidates) if docid in c])].append(docid)
+
+    # Load the candidate articles in blocks and verify them with their filter sets only:
+    filter_plan = fa.compile_filters(bot_infos)
+    results     = [{'candidates': len(c), 'articles': []} for c in candidates]
+    for indices, docids in groups.items():
+        plan = filter_plan.subset(list(indices))
+        for k in range(0, len(docids), 500):
+            block_ids = docids[k:k + 500]
+            rows  = sorted(conn.execute('SELECT pub_date, docid, article FROM articles WHERE docid IN (' + 
+                                        ', '.join(['?'] * len(block_ids)) + ')', block_ids))
+            block = [json.loads(row[2]) for row in rows]
+            for i, selected in zip(indices, plan.select_block(block)):
+                results[i]['articles'].extend([(rows[j][:2], block[j]) for j in selected])
+
+    # Sort by publication date (of the storage's sub-directory) and order of indexing:
+    for result in results:
+        result['articles'] = [article for key, article in sorted(result['articles'], key=lambda item: item[0])]
+    return results
@@ -0,0 +1,703 @@
+#!/usr/bin/env python
+"""
+Benchmarks for parts of the DOU articles capture, using synthetic data
+(no access to in.gov.br is required).
+
+USAGE:   benchmark_dou.py <BENCHMARK> [N] [REPLAY_PATH | FILTER_FILE | DYNAMODB_ENDPOINT]
+EXAMPLE: benchmark_dou.py registry 100000
+
+Available benchmarks:
+registry > Filter N index URLs (half of them already captured) against N captured URLs,
+           comparing the old python list membership with the captured URLs registry
+           (the list is timed over a sample and extrapolated).
+bloom    > Look up N new URLs in a registry of N captured URLs with and without a bloom 
+           filter in front of it, comparing time, peak memory and filter statistics.
+dynamodb > Register N URLs in the DynamoDB registries (plain and partitioned) and look up N URLs
+           in them with and without a bloom filter, checking the results against the local 
+           registries. Runs against DYNAMODB_ENDPOINT (e.g. DynamoDB Local, see dynamodb_endpoint in 
+           the configuration) or, if it is not given, against moto's in-process mock of DynamoDB.
+replay   > Run the whole capture (capture_DOU_driver) over a synthetic corpus of N recorded
+           articles served by the replay mode, with injected latency and errors, for several
+           values of fetch_concurrency.
+extract  > Extract the fields of a large synthetic Seção 3 article (N paragraphs and table rows)
+           with the single-pass get_data and with the original recursive version, checking that
+           both give the same output.
+fulltext > Extract the full text of N articles by streaming the tree's text nodes and by the 
+           original serialize-and-regex method, comparing throughput and checking that both 
+           give the same output. The articles are synthetic or, if REPLAY_PATH is given, the 
+           article pages recorded there (see record_path in the configuration).
+parse    > Parse and structure N articles (synthetic or recorded, as above) with 1, 2 and 4 
+           processes (see parse_processes in the configuration), checking that the output 
+           is the same.
+cache    > Parse and structure N articles in which each page appears twice (as in reruns and
+           backfills) without cache, with the in-memory cache and with a warm on-disk cache
+           (see parse_cache_size and parse_cache_path in the configuration).
+stream   > Parse N synthetic article pages (with a large portal shell after the article) 
+           reading the whole page and reading it only up to the article (see stream_parse 
+           in the configuration), comparing time, bytes read and output.
+filter   > Select N synthetic structured articles with the filter sets in FILTER_FILE (default:
+           filters/all_DOU_filters_2020-04-27.json), calling get_relevant_articles per article and
+           filter set and with the compiled filters (evaluating the filters in the file's order or in
+           reverse order, and reordered by their statistics, and in blocks of 100 articles), checking
+           that the selections are the same, and with all filters ignoring accents (match_mode).
+plan     > Load N filter sets (copies of the ones in FILTER_FILE): format them as before, format
+           and compile them, and reuse the compiled filters from disk and from memory (see 
+           filter_plan_path in the configuration).
+index    > Save N synthetic articles locally, index them (see article_index_path in the 
+           configuration) and select the ones published in 3 days with the filter sets in 
+           FILTER_FILE through the index and by reading all articles saved in those days,
+           checking that the selections are the same.
+"""
+
+import sys
+import os
+import time
+import tempfile
+import tracemalloc
+import random
+import json
+import glob
+import datetime as dt
+import global_settings as gs
+import url_registry as ur
+import bloom_filter as bf
+import replay_http as rh
+import parse_dou_article as pa
+import parse_pool as pp
+import parse_cache as pc
+import filter_articles as fa
+import filter_cache as fc
+import write_article as wa
+import article_index as ai
+import io
+import requests
+from lxml import html
+
+
+### Funções ###
+
+def fake_urls(n, prefix='ato'):
+    """
+    Return a list of `n` DOU-like article URLs.
+    """
+    return ['http://www.in.gov.br/web/dou/-/' + prefix + '-n-' + str(i) + '-de-4-de-setembro-de-2019-' + str(214566522 + i)
+            for i in range(n)]
+
+
+def fake_article_html(i):
+    """
+    Return the HTML (str) of a synthetic DOU article page, number `i`.
+    """
+    return ('<html><head><title>Portaria</title></head><body>'
+            '<div class="botao-materia"><a href="http://pesquisa.in.gov.br/imprensa/jsp/visualiza/index.jsp?data=04/09/2019&amp;jornal=515&amp;pagina=' + str(i) + '">Versão certificada</a></div>'
+            '<div id="materia" class="materia"><div class="detalhes-dou"><p>'
+            '<span class="publicado-dou">Publicado em: <span class="publicado-dou-data">04/09/2019</span></span> | '
+            '<span class="edicao-dou">Edição: <span class="edicao-dou-data">171</span></span> | '
+            '<span class="secao-dou">Seção: 1</span> | <span class="secao-dou-data">Página: ' + str(i) + '</span></p>'
+            '<p class="orgao-dou">Órgão: <span class="orgao-dou-data">Ministério da Economia/Secretaria Especial de Fazenda</span></p></div>'
+            '<div class="texto-dou"><p class="identifica">PORTARIA Nº ' + str(i) + ', DE 3 DE SETEMBRO DE 2019</p>'
+            '<p class="ementa">Dispõe sobre a ação de teste &amp; validação.</p>'
+            '<p class="dou-paragraph">O MINISTRO, no uso das atribuições <b>que lhe confere</b> o art. 87, resolve:</p>'
+            '<p class="dou-paragraph">Art. 1º Fica aprovado o regulamento.</p>'
+            '<p class="assina">FULANO DE TAL</p><p class="cargo">Ministro</p></div></div></body></html>')
+
+
+def fake_corpus(replay_path, date, n):
+    """
+    Record, in the directory `replay_path`, a DOU index page for the date
+    `date` (datetime) and section 1 listing `n` articles, and the pages
+    of these articles.
+    """
+    url_titles = ['portaria-n-' + str(i) + '-de-3-de-setembro-de-2019-' + str(214566522 + i) for i in range(n)]
+    jsons      = [{'urlTitle': t, 'pubDate': date.strftime('%d/%m/%Y'), 'pubName': 'DO1'} for t in url_titles]
+    index_html = '<html><body><script id="params" type="application/json">' + json.dumps({'jsonArray': jsons}) + '</script></body></html>'
+    headers    = {'Content-Type': 'text/html; charset=utf-8'}
+    rh.save_response(replay_path, 'http://www.in.gov.br/leiturajornal?data=' + date.strftime('%d-%m-%Y') + '&secao=do1',
+                     200, headers, index_html.encode('utf-8'))
+    for i, t in enumerate(url_titles):
+        rh.save_response(replay_path, 'http://www.in.gov.br/web/dou/-/' + t, 200, headers, fake_article_html(i).encode('utf-8'))
+
+
+def fake_large_article_html(n):
+    """
+    Return the HTML (str) of a synthetic long Seção 3 article (e.g. a 
+    list of contract extracts), with `n` paragraphs and `n` table rows.
+    """
+    paragraphs = ''.join(['<p class="dou-paragraph">EXTRATO DE CONTRATO Nº ' + str(i) + '/2019. Contratante: Ministério da Economia. '
+                          'Contratado: Empresa ' + str(i) + ' <b>LTDA</b>. Objeto: prestação de serviços. Valor: R$ ' + str(1000 + i) + ',00.</p>'
+                          for i in range(n)])
+    rows       = ''.join(['<tr><td class="dou-table-cell">' + str(i) + '</td><td class="dou-table-cell">Item ' + str(i) + '</td></tr>'
+                          for i in range(n)])
+    return ('<html><body><div class="botao-materia"><a href="http://pesquisa.in.gov.br/imprensa/jsp/visualiza/index.jsp">Versão certificada</a></div>'
+            '<div id="materia" class="materia"><div class="detalhes-dou"><p><span class="secao-dou">Seção: 3</span></p></div>'
+            '<div class="texto-dou"><p class="identifica">EXTRATOS DE CONTRATOS</p>' + paragraphs + 
+            '<table class="dou-table"><tbody>' + rows + '</tbody></table>'
+            '<p class="assina">FULANO DE TAL</p></div></div></body></html>')
+
+
+def benchmark_extract(n):
+    """
+    Time the extraction of fields (get_data) from an article with `n`
+    paragraphs and `n` table rows, with the single-pass and the original
+    recursive extractors.
+    """
+    article = pa.select_article_text(fake_large_article_html(n))
+    
+    t0 = time.perf_counter()
+    legacy = pa.get_data_legacy(article)
+    t_legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    data = pa.get_data(article)
+    t_data = time.perf_counter() - t0
+    
+    print('recursive:   %8.4f s' % t_legacy)
+    print('single-pass: %8.4f s' % t_data)
+    print('speed-up:    %8.1fx' % (t_legacy / t_data))
+    print('same output:', list(data.items()) == list(legacy.items()))
+
+
+def corpus_texts(n, replay_path=None):
+    """
+    Return a list of `n` articles' html (str): the article pages recorded
+    in `replay_path` (str), if given, or synthetic ones (one large article
+    for every 100 small ones) otherwise.
+    """
+    if replay_path is None:
+        return [fake_large_article_html(1000) if i % 100 == 99 else fake_article_html(i) for i in range(n)]
+
+    texts = []
+    for filename in sorted(glob.glob(os.path.join(replay_path, '*.json'))):
+        meta, content = rh.load_response(replay_path, json.load(open(filename))['url'])
+        if meta['status_code'] == 200 and '/web/dou/-/' in meta['url']:
+            encoding = requests.utils.get_encoding_from_headers(meta['headers']) or 'utf-8'
+            texts.append(str(content, encoding, errors='replace'))
+            if len(texts) == n:
+                break
+    return texts
+
+
+def corpus_articles(n, replay_path=None):
+    """
+    Return a list of `n` articles' #materia elements (lxml), from the 
+    html returned by corpus_texts.
+    """
+    return [pa.select_article_text(text) for text in corpus_texts(n, replay_path)]
+
+
+def benchmark_fulltext(n, replay_path=None):
+    """
+    Time the extraction of the full text of `n` articles (see 
+    corpus_articles) with the streamed and the serialized methods.
+    """
+    articles = corpus_articles(n, replay_path)
+    nbytes   = sum([len(html.tostring(a)) for a in articles])
+    
+    t0 = time.perf_counter()
+    serialized = [pa.serialized_full_text(a) for a in articles]
+    t_serialized = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    streamed = [pa.decoded_full_text(a) for a in articles]
+    t_streamed = time.perf_counter() - t0
+    
+    print('# articles:  %d (%.1f MB of html), %d with fallback to serialization' % 
+          (len(articles), nbytes / 1e6, sum([pa.streamed_full_text(a) is None for a in articles])))
+    print('serialized: %8.4f s, %8.1f articles/s, %6.1f MB/s' % (t_serialized, len(articles) / t_serialized, nbytes / 1e6 / t_serialized))
+    print('streamed:   %8.4f s, %8.1f articles/s, %6.1f MB/s' % (t_streamed, len(articles) / t_streamed, nbytes / 1e6 / t_streamed))
+    print('speed-up:   %8.1fx' % (t_serialized / t_streamed))
+    print('same output:', streamed == serialized)
+
+
+def benchmark_parse(n, replay_path=None):
+    """
+    Time the parsing and structuring of `n` articles (see corpus_texts)
+    with 1, 2 and 4 processes.
+    """
+    texts = corpus_texts(n, replay_path)
+    items = [(i, text, 'http://www.in.gov.br/web/dou/-/' + str(i)) for i, text in enumerate(texts)]
+    print('# articles: %d, # cores: %d' % (len(texts), os.cpu_count()))
+    
+    results = {}
+    for processes in [1, 2, 4]:
+        t0 = time.perf_counter()
+        parsed = [p for i, p in pp.parse_stream(items, processes)]
+        dt_run = time.perf_counter() - t0
+        # Compare without the capture date:
+        results[processes] = [[{k: v for k, v in d.items() if k != 'capture_date'} for d in raw.rows()] for raw, article in parsed]
+        print('processes %d: %8.4f s, %8.1f articles/s' % (processes, dt_run, len(texts) / dt_run))
+    print('same output:', results[1] == results[2] == results[4])
+
+
+def benchmark_cache(n):
+    """
+    Time the parsing and structuring of `n` articles (n / 2 distinct 
+    pages, each appearing twice) without and with a parse cache.
+    """
+    texts = corpus_texts(n // 2)
+    items = [(i, text, 'http://www.in.gov.br/web/dou/-/' + str(i)) for i, text in enumerate(texts + texts)]
+    # Compare without the capture date:
+    strip = lambda parsed: [([{k: v for k, v in d.items() if k != 'capture_date'} for d in raw.rows()],
+                             {k: v for k, v in article.items() if k != 'capture_date'}) for raw, article in parsed]
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        runs = [('no cache:', None), ('memory:', pc.ParseCache(n)), ('disk:', pc.ParseCache(n, tmpdir)), 
+                ('warm disk:', pc.ParseCache(n, tmpdir))]
+        for name, cache in runs:
+            t0 = time.perf_counter()
+            parsed = [p for i, p in pp.parse_stream(items, 1, cache)]
+            dt_run = time.perf_counter() - t0
+            if cache is None:
+                reference = strip(parsed)
+                print('%-11s %8.4f s' % (name, dt_run))
+            else:
+                print('%-11s %8.4f s, same output: %s, %s' % (name, dt_run, strip(parsed) == reference, cache.stats()))
+
+
+def fake_portal_page(i, shell_size=2000):
+    """
+    Return the html (bytes) of a synthetic article page `i` followed by
+    a portal shell (menus, footer etc.) with `shell_size` blocks.
+    """
+    shell = ''.join(['<div class="portal-block"><p>Link ' + str(j) + '</p><ul><li>Item</li><li>Item</li></ul></div>'
+                     for j in range(shell_size)])
+    return fake_article_html(i).replace('</div></body>', '</div>' + shell + '</body>').encode('utf-8')
+
+
+class CountingBytesIO(io.BytesIO):
+    """
+    Bytes stream that counts the bytes read from it (in `nread`).
+    """
+    nread = 0
+    
+    def read(self, size=-1):
+        data = super().read(size)
+        self.nread = self.nread + len(data)
+        return data
+
+
+def streamed_response(content):
+    """
+    Return a requests Response whose body `content` (bytes) was not read
+    yet, as one requested with stream=True.
+    """
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw         = CountingBytesIO(content)
+    response.encoding    = 'utf-8'
+    return response
+
+
+def benchmark_stream(n):
+    """
+    Time the parsing of `n` article pages read as a whole and read only
+    up to the article.
+    """
+    pages = [fake_portal_page(i) for i in range(n)]
+    url   = 'http://www.in.gov.br/web/dou/-/portaria'
+    
+    t0 = time.perf_counter()
+    whole = []
+    for page in pages:
+        response = streamed_response(page)
+        whole.append(pa.parse_dou_article(response, url))
+    t_whole = time.perf_counter() - t0
+    
+    t0 = time.perf_counter()
+    streamed = []
+    nbytes   = 0
+    for page in pages:
+        response = streamed_response(page)
+        streamed.append(pa.parse_dou_stream(response, url))
+        nbytes = nbytes + response.raw.nread
+    t_streamed = time.perf_counter() - t0
+    
+    total = sum([len(page) for page in pages])
+    print('whole page:   %8.4f s, %8.1f MB read' % (t_whole, total / 1e6))
+    print('up to article:%8.4f s, %8.1f MB read' % (t_streamed, nbytes / 1e6))
+    print('speed-up:     %8.1fx' % (t_whole / t_streamed))
+    # Compare without the capture date:
+    strip = lambda raw: [{k: v for k, v in d.items() if k != 'capture_date'} for d in raw.rows()]
+    print('same output:', [strip(raw) for raw in whole] == [strip(raw) for raw in streamed])
+
+
+def fake_structured_articles(n, bot_infos, seed=0):
+    """
+    Return a list of `n` synthetic structured articles (dicts, see 
+    structure_article) whose fields mix common words with the keywords 
+    used in the filter sets `bot_infos` (see filter_articles.format_filters).
+    """
+    rng      = random.Random(seed)
+    keywords = [var for bot_info in bot_infos for f in bot_info['filters'] 
+                for var in f.get('positive_filter', []) + f.get('negative_filter', [])]
+    words    = ('o ministro de estado no uso das atribuições que lhe confere o art. 87 da constituição resolve '
+                'fica aprovado regulamento contrato empresa objeto prestação serviços valor processo').split()
+    orgaos   = ['Ministério da Educação', 'Ministério da Economia/Secretaria Especial de Fazenda', 
+                'Ministério da Saúde', 'Presidência da República', 'Ministério da Mulher, da Família e dos Direitos Humanos']
+    text     = lambda size: ' '.join([rng.choice(keywords) if rng.random() < 0.001 else rng.choice(words) for _ in range(size)])
+    articles = []
+    for i in range(n):
+        paragraph = text(rng.randint(50, 1500)).upper() if rng.random() < 0.3 else text(rng.randint(50, 1500))
+        articles.append({'secao': rng.choice(['1', '2', '3', '1 Extra', '1a']), 'orgao': rng.choice(orgaos),
+                         'assina': rng.choice(['FULANO DE TAL', 'JAIR MESSIAS BOLSONARO', 'HAMILTON MOURÃO']),
+                         'identifica': 'PORTARIA Nº ' + str(i) + ', DE 3 DE SETEMBRO DE 2019', 'ementa': text(20),
+                         'alltext': paragraph, 'fulltext': paragraph})
+    return articles
+
+
+def benchmark_filter(n, filter_file):
+    """
+    Time the selection of `n` synthetic articles by the filter sets in 
+    `filter_file` with get_relevant_articles (one call per article and 
+    filter set) and with the compiled filters (filter_articles.FilterPlan).
+    """
+    gs.debug  = False
+    bot_infos = fa.format_filters(fa.load_local_filters(filter_file))
+    articles  = fake_structured_articles(n, bot_infos)
+    print('# articles: %d, # filter sets: %d' % (len(articles), len(bot_infos)))
+    
+    t0 = time.perf_counter()
+    legacy = [[i for i in range(len(bot_infos)) if len(fa.get_relevant_articles(bot_infos[i], [article])) > 0] 
+              for article in articles]
+    t_legacy = time.perf_counter() - t0
+    print('get_relevant_articles: %8.4f s, %8.1f articles/s' % (t_legacy, len(articles) / t_legacy))
+    
+    # The same filter sets, with the filters in reverse order:
+    reversed_infos = [dict(bot_info, filters=bot_info['filters'][::-1]) for bot_info in bot_infos]
+    runs = [('file order:', bot_infos, None), ('reordered:', bot_infos, max(1, n // 20)), 
+            ('reversed file order:', reversed_infos, None), ('reversed, reordered:', reversed_infos, max(1, n // 20))]
+    for name, infos, reorder_interval in runs:
+        t0 = time.perf_counter()
+        filter_plan = fa.compile_filters(infos, reorder_interval)
+        t_compile = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        selected = [filter_plan.select(article) for article in articles]
+        t_plan = time.perf_counter() - t0
+        print('%-22s %8.4f s, %8.1f articles/s (+ %.4f s to compile), speed-up %.1fx, same output: %s' % 
+              (name, t_plan, len(articles) / t_plan, t_compile, t_legacy / t_plan, selected == legacy))
+    print('# selections: %d' % sum([len(s) for s in selected]))
+    
+    # Filter in blocks of 100 articles (selections per filter set instead of per article):
+    filter_plan = fa.compile_filters(bot_infos)
+    t0 = time.perf_counter()
+    selections = [filter_plan.select_block(articles[k:k + 100]) for k in range(0, len(articles), 100)]
+    t_block = time.perf_counter() - t0
+    by_article = [[] for article in articles]
+    for b, block_selections in enumerate(selections):
+        for i, indices in enumerate(block_selections):
+            for k in indices:
+                by_article[100 * b + k].append(i)
+    print('%-22s %8.4f s, %8.1f articles/s, same output: %s' % ('blocks of 100:', t_block, len(articles) / t_block, by_article == legacy))
+    
+    # Ignoring accents (each field is normalized once per article, however many filters use it):
+    normalized_infos = [dict(bot_info, filters=[dict(f, match_mode='normalized') for f in bot_info['filters']]) for bot_info in bot_infos]
+    filter_plan = fa.compile_filters(normalized_infos)
+    t0 = time.perf_counter()
+    normalized = [filter_plan.select(article) for article in articles]
+    t_normalized = time.perf_counter() - t0
+    print('%-22s %8.4f s, %8.1f articles/s, # selections: %d' % 
+          ('normalized matching:', t_normalized, len(articles) / t_normalized, sum([len(s) for s in normalized])))
+    print('Routing by section and agency:', filter_plan.routing_stats())
+    print('Predicates shared among filter sets:', filter_plan.sharing_stats())
+    print('Most expensive predicates:')
+    for row in filter_plan.report()[:5]:
+        print(row)
+
+
+def benchmark_plan(n, filter_file):
+    """
+    Time the loading of `n` filter sets (copies of the ones in `filter_file`
+    with new filter numbers): formatting them by rescanning all filters for
+    each filter set (as before), formatting and compiling them, and reusing
+    the compiled filters from disk and from memory (filter_cache.compiled_filters).
+    """
+    gs.debug    = False
+    filters_raw = fa.load_local_filters(filter_file)
+    numbers     = sorted(set([f['filter_number'] for f in filters_raw]))
+    copies      = [dict(f, filter_number=c * len(numbers) + numbers.index(f['filter_number'])) 
+                   for c in range(n // len(numbers) + 1) for f in filters_raw]
+    copies      = [f for f in copies if f['filter_number'] < n]
+    print('# filter sets: %d, # filters: %d' % (n, len(copies)))
+    
+    t0 = time.perf_counter()
+    rescanned = [fa.filterset_gen(copies, fnumber) for fnumber in range(n)]
+    t_rescan = time.perf_counter() - t0
+    print('rescan per set:   %8.4f s (grouping only)' % t_rescan)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = {'filter_file': os.path.join(tmpdir, 'filters.json'), 'filter_plan_path': os.path.join(tmpdir, 'plans')}
+        with open(config['filter_file'], 'w') as f:
+            json.dump(copies, f)
+        runs = [('compile:', True), ('from disk:', True), ('from memory:', False)]
+        for name, forget in runs:
+            if forget:
+                fc.loaded_plans.clear()
+            t0 = time.perf_counter()
+            plan = fc.compiled_filters(config)
+            print('%-17s %8.4f s' % (name, time.perf_counter() - t0))
+    print('same filter sets:', [bot_info['filters'] for bot_info in plan.bot_infos] == rescanned)
+
+
+def benchmark_index(n, filter_file):
+    """
+    Save `n` synthetic articles (published over 10 days) as in captures
+    with save_articles set, index them (article_index.update_index), update
+    the index again (nothing changed) and evaluate the filter sets in
+    `filter_file` over 3 days through the index and by reading and
+    structuring all saved articles of those days, checking that the
+    selections are the same.
+    """
+    gs.debug  = False
+    bot_infos = fa.format_filters(fa.load_local_filters(filter_file))
+    structs   = fake_structured_articles(n, bot_infos)
+    dates     = ['2020-01-%02d' % (d + 1) for d in range(10)]
+    print('# articles: %d, # filter sets: %d' % (n, len(bot_infos)))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = {'storage_path': tmpdir}
+        for i, struct in enumerate(structs):
+            date   = dates[i % len(dates)]
+            fields = {'secao-dou': 'Seção: ' + struct['secao'] + ' | Página: 1', 'orgao-dou-data': struct['orgao'],
+                      'assina': struct['assina'], 'identifica': struct['identifica'], 'ementa': struct['ementa'],
+                      'dou-paragraph': struct['alltext'], 'fulltext': struct['fulltext'],
+                      'publicado-dou-data': dt.datetime.strptime(date, '%Y-%m-%d').strftime('%d/%m/%Y')}
+            wa.write_local_article(config, pa.RawArticle(fields, 'http://www.in.gov.br/web/dou/-/ato-' + str(i), 
+                                                         date + ' 10:00:00', ''), 'ato-' + str(i) + '.json')
+        
+        conn = ai.open_config_index(config)
+        for name in ['index:', 'update:']:
+            t0 = time.perf_counter()
+            counts = ai.update_index(conn, tmpdir)
+            print('%-9s %8.4f s' % (name, time.perf_counter() - t0), counts)
+
+        start_date, end_date = dates[3], dates[5]
+        t0 = time.perf_counter()
+        results = ai.evaluate_filters(conn, bot_infos, start_date, end_date)
+        t_index = time.perf_counter() - t0
+        conn.close()
+        print('search:   %8.4f s, candidates: %d, selected: %d' % (t_index, sum([r['candidates'] for r in results]), 
+                                                                 sum([len(r['articles']) for r in results])))
+        
+        t0 = time.perf_counter()
+        articles = [ai.read_local_article(filename) for date in dates[3:6] 
+                    for filename in sorted(glob.glob(os.path.join(tmpdir, date, '*')))]
+        selected = fa.compile_filters(bot_infos).select_block(articles)
+        print('scan:     %8.4f s' % (time.perf_counter() - t0))
+    
+    print('same selections:', [sorted([a['url'] for a in r['articles']]) for r in results] == 
+          [sorted([articles[i]['url'] for i in indices]) for indices in selected])
+
+
+def benchmark_registry(n):
+    """
+    Time the filtering of `n` url_files against `n` captured URLs.
+    """
+    captured  = fake_urls(n)
+    url_files = [{'url': url, 'filename': ''} for url in captured[n // 2:] + fake_urls(n // 2, 'portaria')]
+
+    # Old implementation (list membership), timed over a sample:
+    sample = url_files[::max(1, len(url_files) // 1000)]
+    t0 = time.perf_counter()
+    list(filter(lambda d: d['url'] not in captured, sample))
+    t_list = (time.perf_counter() - t0) * len(url_files) / len(sample)
+    print('list:     %10.4f s (extrapolated from %d lookups)' % (t_list, len(sample)))
+
+    # Registry:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'url_list.txt')
+        t0 = time.perf_counter()
+        registry = ur.LocalURLRegistry(filename)
+        registry.add_many(captured)
+        t_add = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        registry = ur.LocalURLRegistry(filename)
+        t_load = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        to_capture = ur.filter_new(registry, url_files)
+        t_filter = time.perf_counter() - t0
+    print('registry: %10.4f s (+ %.4f s to load, %.4f s to add %d URLs)' % (t_filter, t_load, t_add, n))
+    print('speed-up: %10.0fx' % (t_list / t_filter))
+    print('# to capture:', len(to_capture))
+
+
+def benchmark_bloom(n):
+    """
+    Time the lookup of `n` new URLs in a registry of `n` captured URLs,
+    with and without a bloom filter.
+    """
+    new_urls = fake_urls(n, 'portaria')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'url_list.txt')
+        ur.LocalURLRegistry(filename).add_many(fake_urls(n))
+
+        for make_bloom in [lambda: None, lambda: bf.BloomFilter(n, 0.001)]:
+            # Time (without tracemalloc overhead):
+            t0 = time.perf_counter()
+            registry = ur.LocalURLRegistry(filename, bloom=make_bloom())
+            found    = sum(registry.contains_many(new_urls))
+            t_lookup = time.perf_counter() - t0
+            # Peak memory:
+            tracemalloc.start()
+            sum(ur.LocalURLRegistry(filename, bloom=make_bloom()).contains_many(new_urls))
+            peak     = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('%-9s %8.4f s, peak memory %8.1f MB, found %d' % ('exact:' if registry.bloom is None else 'bloom:', t_lookup, peak / 1e6, found))
+        print('bloom stats:', registry.bloom_stats())
+
+
+def benchmark_dynamodb(n, endpoint_url=None):
+    """
+    Run the DynamoDB registries of captured URLs (url_registry.AWSURLRegistry
+    and AWSPartitionedURLRegistry) against the DynamoDB service at 
+    `endpoint_url` (e.g. DynamoDB Local) or, if it is None, against moto's 
+    in-process mock: register `n` URLs in batches, reload them, look up 
+    `n` URLs (half of them registered) with and without a bloom filter and
+    expire old partitions, checking the results against the local registries.
+    """
+    import boto3
+    gs.debug = False
+    if endpoint_url is None:
+        try:
+            from moto import mock_aws
+        except ImportError:
+            print('benchmark_dynamodb: give a DYNAMODB_ENDPOINT or install moto.')
+            return
+        for var in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']:
+            os.environ.setdefault(var, 'testing')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        mock = mock_aws()
+        mock.start()
+
+    # Tables as in the AWS version (see the README):
+    client = boto3.client('dynamodb', endpoint_url=endpoint_url)
+    tables = {'bench_url_list': [('url', 'HASH')], 'bench_url_list_partitioned': [('partition', 'HASH'), ('url', 'RANGE')]}
+    for name, keys in tables.items():
+        if name in client.list_tables()['TableNames']:
+            client.delete_table(TableName=name)
+            client.get_waiter('table_not_exists').wait(TableName=name)
+        client.create_table(TableName=name, BillingMode='PAY_PER_REQUEST',
+                            KeySchema=[{'AttributeName': k, 'KeyType': t} for k, t in keys],
+                            AttributeDefinitions=[{'AttributeName': k, 'AttributeType': 'S'} for k, t in keys])
+        client.get_waiter('table_exists').wait(TableName=name)
+
+    captured   = fake_urls(n)
+    lookups    = captured[n // 2:] + fake_urls(n // 2, 'portaria')
+    dates      = ['2020-01-%02d' % (d + 1) for d in range(10)]
+    partitions = [ur.partition_name(dates[i % len(dates)], 1) for i in range(n)]
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Unpartitioned registry:
+            local = ur.LocalURLRegistry(os.path.join(tmpdir, 'url_list.txt'), flush_size=50)
+            t0 = time.perf_counter()
+            with ur.AWSURLRegistry('bench_url_list', flush_size=50, endpoint_url=endpoint_url) as registry:
+                for url in captured:
+                    registry.add(url)
+                    local.add(url)
+            local.flush()
+            print('write:            %8.4f s' % (time.perf_counter() - t0))
+            expected = local.contains_many(lookups)
+            for bloom in [None, bf.BloomFilter(n, 0.001)]:
+                t0 = time.perf_counter()
+                registry = ur.AWSURLRegistry('bench_url_list', endpoint_url=endpoint_url, bloom=bloom)
+                found    = registry.contains_many(lookups)
+                print('%-17s %8.4f s, same as local: %s' % ('load and lookup:' if bloom is None else 'with bloom:', 
+                                                            time.perf_counter() - t0, found == expected), registry.bloom_stats())
+            registry.erase()
+            print('erased:', len(ur.AWSURLRegistry('bench_url_list', endpoint_url=endpoint_url)) == 0)
+
+            # Partitioned registry:
+            local = ur.LocalPartitionedURLRegistry(os.path.join(tmpdir, 'partitions'), flush_size=50)
+            t0 = time.perf_counter()
+            with ur.AWSPartitionedURLRegistry('bench_url_list_partitioned', flush_size=50, endpoint_url=endpoint_url) as registry:
+                for url, partition in zip(captured, partitions):
+                    registry.add(url, partition)
+                    local.add(url, partition)
+            local.flush()
+            print('partitioned write:%8.4f s' % (time.perf_counter() - t0))
+            lookup_partitions = set(partitions)
+            local.load_partitions(lookup_partitions)
+            expected = local.contains_many(lookups)
+            for bloom in [None, bf.BloomFilter(n, 0.001)]:
+                t0 = time.perf_counter()
+                registry = ur.AWSPartitionedURLRegistry('bench_url_list_partitioned', endpoint_url=endpoint_url, bloom=bloom)
+                registry.load_partitions(lookup_partitions)
+                found    = registry.contains_many(lookups)
+                print('%-17s %8.4f s, same as local: %s' % ('load and lookup:' if bloom is None else 'with bloom:',
+                                                            time.perf_counter() - t0, found == expected), registry.bloom_stats())
+            expires = set([item.get('expires_at') is not None for item in client.scan(TableName='bench_url_list_partitioned')['Items']])
+            print('expires_at set:', expires)
+            registry.expire(dt.datetime(2020, 1, 6))
+            local.expire(dt.datetime(2020, 1, 6))
+            print('same after expire:', sorted(registry.read_loaded()) == sorted(local.read_loaded()))
+    finally:
+        if endpoint_url is None:
+            mock.stop()
+
+
+def benchmark_replay(n, latency=0.02, error_rate=0.05):
+    """
+    Time the whole capture of `n` articles served by the replay mode,
+    with `latency` seconds per request and a fraction `error_rate` of
+    failed requests, for several fetch concurrencies.
+    """
+    import capture_driver as cd
+    gs.debug = False
+    date = dt.datetime(2019, 9, 4)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        replay_path = os.path.join(tmpdir, 'replay')
+        fake_corpus(replay_path, date, n)
+        results = []
+        for concurrency in [1, 4, 16]:
+            url_list = os.path.join(tmpdir, 'url_list_' + str(concurrency) + '.txt')
+            config   = {'date_format': '%Y-%m-%d', 'end_date': date.strftime('%Y-%m-%d'), 'timedelta': 0, 'secao': [1],
+                        'storage_path': tmpdir, 'save_articles': False, 'post_articles': False,
+                        'filter_file': '../filters/sistemas_DOU_filters.json', 'url_list': url_list,
+                        'daily_clean_url_list': False, 'fetch_concurrency': concurrency, 'replay_path': replay_path,
+                        'replay_latency': latency, 'replay_error_rate': error_rate}
+            t0 = time.perf_counter()
+            cd.capture_DOU_driver(config)
+            dt_run   = time.perf_counter() - t0
+            captured = len(list(ur.LocalURLRegistry(url_list).read_all()))
+            results.append((concurrency, dt_run, captured))
+    for concurrency, dt_run, captured in results:
+        print('concurrency %2d: %8.3f s, %7.1f articles/s, %d of %d captured' % (concurrency, dt_run, captured / dt_run, captured, n))
+
+
+### Main ###
+
+# Docstring output:
+if len(sys.argv) < 1 + 1:
+    print(__doc__)
+    sys.exit(0)
+
+# Get input:
+benchmark = sys.argv[1]
+n         = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+replay_path = sys.argv[3] if len(sys.argv) > 3 else None
+default_filter_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../filters/all_DOU_filters_2020-04-27.json')
+
+if benchmark == 'registry':
+    benchmark_registry(n)
+elif benchmark == 'bloom':
+    benchmark_bloom(n)
+elif benchmark == 'dynamodb':
+    benchmark_dynamodb(n, sys.argv[3] if len(sys.argv) > 3 else None)
+elif benchmark == 'replay':
+    benchmark_replay(n)
+elif benchmark == 'extract':
+    benchmark_extract(n)
+elif benchmark == 'fulltext':
+    benchmark_fulltext(n, replay_path)
+elif benchmark == 'parse':
+    benchmark_parse(n, replay_path)
+elif benchmark == 'stream':
+    benchmark_stream(n)
+elif benchmark == 'cache':
+    benchmark_cache(n)
+elif benchmark == 'filter':
+    benchmark_filter(n, sys.argv[3] if len(sys.argv) > 3 else default_filter_file)
+elif benchmark == 'plan':
+    benchmark_plan(n, sys.argv[3] if len(sys.argv) > 3 else default_filter_file)
+elif benchmark == 'index':
+    benchmark_index(n, sys.argv[3] if len(sys.argv) > 3 else default_filter_file)
+else:
+    print(__doc__)
+    sys.exit(1)
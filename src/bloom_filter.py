@@ -0,0 +1,59 @@
+import math
+import hashlib
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set of strings: membership tests never give
+    false negatives and give false positives with probability close to
+    `error_rate` as long as at most `capacity` strings were added.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Create an empty filter sized for `capacity` (int) strings and a
+        false positive rate `error_rate` (float).
+        """
+        self.capacity   = capacity
+        self.error_rate = error_rate
+        # Optimal number of bits and of hash functions:
+        self.nbits   = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.bits    = bytearray((self.nbits + 7) // 8)
+        self.count   = 0
+
+    def positions(self, item):
+        """
+        Return the bit positions (list of int) of the string `item`,
+        computed by double hashing a single digest.
+        """
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        nbits = self.nbits
+        return [(h1 + i * h2) % nbits for i in range(self.nhashes)]
+
+    def add(self, item):
+        """
+        Add the string `item` to the filter.
+        """
+        bits = self.bits
+        for p in self.positions(item):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count = self.count + 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for p in self.positions(item):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def memory(self):
+        """
+        Return the size (int) of the filter's bit array, in bytes.
+        """
+        return len(self.bits)
@@ -1,11 +1,13 @@
-import requests
 # This project's functions:
 import global_settings as gs
 import get_articles_url as gu
-import parse_dou_article as pa
+import fetch_articles as ft
+import url_registry as ur
+import article_archive as aa
+import parse_pool as pp
+import parse_cache as pc
 import write_article as wa
-import filter_articles as fa
-import structure_article as sa
+import filter_cache as fc
 import post_to_slack as ps
 
 
@@ -50,6 +52,25 @@ def captured_article_ok(save_option, saved, post_option, posted):
     return False
 
 
+def add_selected_articles(config, bot_infos, relevant_articles, block, selections):
+    """
+    Append the articles in `block` (list of dicts) selected by each filter
+    set in `bot_infos` (`selections`, see filter_articles.FilterPlan.select_block)
+    to the filter set's list in `relevant_articles`, posting the lists
+    that get more than 20 articles if config['post_articles'] is True.
+    """
+    for i, indices in enumerate(selections):
+        for k in indices:
+            relevant_articles[i].append(block[k])
+            # Slack crashes if message has more than 50 blocks.
+            # Avoid this by pre-posting long messages:
+            if config['post_articles'] and len(relevant_articles[i]) > 20:
+                if gs.debug:
+                    print('Selected more than 20 articles.')
+                ps.post_article(config, bot_infos[i], relevant_articles[i])
+                relevant_articles[i] = []
+
+
 def capture_DOU_driver(event):
     """
     This is the driver that runs DOU articles' capture.
@@ -66,8 +87,30 @@ def capture_DOU_driver(event):
     * timedelta:     the number of days in the pasr from end_date to start the search
                      (a negative number);
     * filter_file:   JSON filename that describes the filters to be applied to articles;
+    * filter_plan_path: directory where the compiled filters are stored, so they are only compiled
+                        again when the filters change (optional; they are always kept in memory 
+                        between captures of the same process);
+    * filter_block_size: number of captured articles filtered at once (optional, default 100);
     * post_articles: BOOL that tells whether or not to post articles to Slack;
-    * slack_token:   Filename for file containing Slack's authentication token.
+    * slack_token:   Filename for file containing Slack's authentication token;
+    * fetch_concurrency: number of articles downloaded simultaneously (optional, default 1);
+    * fetch_timeout: timeout in seconds for each article GET (optional, default 15);
+    * parse_processes: number of processes that parse the articles while others are 
+                       downloaded (optional, default 1, i.e. parse in the same process);
+    * stream_parse: BOOL that tells whether or not to stop downloading and parsing each article's
+                    page after the article (optional, default False; ignored if parse_processes > 1
+                    or archive_path is set; with record_path, the whole pages are still downloaded, 
+                    in order to record them);
+    * parse_cache_size: number of parsed articles kept in memory, so identical pages are not parsed 
+                        again (optional, default: no cache; not used with stream_parse);
+    * parse_cache_path: directory where parsed articles are also cached (optional);
+    * registry_flush_size: number of captured URLs registered at once (optional, default 50);
+    * registry_flush_interval: maximum number of seconds between registrations (optional, default 60);
+    * archive_path: directory where the articles' raw HTML are archived, to be reparsed later 
+                    with reparse_archive_driver (optional, default: no archive);
+    * replay_path, replay_latency, replay_error_rate, replay_seed, record_path: serve the index
+      and article pages from (or record them to) a local directory (optional, see 
+      fetch_articles.config_session).
 
     It returns an updated configuration file for the next capture (assuming one wants 
     to periodically capture the DOU publications.
@@ -84,72 +127,76 @@ def capture_DOU_driver(event):
     # Get list of URLs and filenames (in case one wants to save the articles):    
     if gs.debug:
         print("Getting articles' URLs...")
-    url_file_list, next_config = gu.get_articles_url(config)
+    registry = ur.open_config_registry(config)
+    url_file_list, next_config = gu.get_articles_url(config, registry)
     Nurls = len(url_file_list)
     if True or gs.debug:
         print('# URLs:', Nurls)
+    if gs.debug and registry.bloom != None:
+        print('Captured URLs bloom filter:', registry.bloom_stats())
     if Nurls == 0:
+        gu.commit_index_snapshots(config)
         return next_config    
     
-    # Load filters:
+    # Load filters (compiled again only if they changed since the last capture):
     if gs.debug:
         print("Loading filters...")    
-    if gs.local:
-        filters = fa.load_local_filters(config['filter_file'])
-    else:
-        filters = fa.load_remote_filters()
-    bot_infos = fa.format_filters(filters)
+    filter_plan = fc.compiled_filters(config)
 
     # Remove filters (that need to exist to select articles) that eliminate all downloaded sections:
     if gs.debug:
-        Nfilters = len(bot_infos)
+        Nfilters = len(filter_plan.bot_infos)
         print("Removing unecessary filters...")
-    bot_infos = list(filter(lambda bot_info: len(fa.secao_left(config['secao'], bot_info))>0, bot_infos))
+    filter_plan = filter_plan.for_sections(config['secao'])
+    bot_infos   = filter_plan.bot_infos
     if gs.debug:
         print("Removed " + str(Nfilters - len(bot_infos)) + " filters.")
 
-    # Specifies number of retries for GET:
-    session = requests.Session()
-    session.mount('http://www.in.gov.br', requests.adapters.HTTPAdapter(max_retries=3))
+    # Specifies number of simultaneous GETs, number of retries and timeout:
+    concurrency = config.get('fetch_concurrency', 1)
+    timeout     = config.get('fetch_timeout', 15)
+    processes   = config.get('parse_processes', 1)
+    # Only read articles' pages up to the article (not possible if the whole page is archived or parsed elsewhere):
+    stream      = config.get('stream_parse', False) and processes <= 1 and config.get('archive_path') is None
+    # (streamed responses hold their connections until read, at most 2 x concurrency + 1 of them):
+    session     = ft.config_session(config, 2 * concurrency + 1 if stream else concurrency)
     
-    # The lists inside relevant_articles will receive the articles selected by each filter set:
-    relevant_articles = [[]]*len(bot_infos)
+    # The lists inside relevant_articles will receive the articles selected by each filter set
+    # (the articles are filtered in blocks of block_size):
+    relevant_articles = [[] for bot_info in bot_infos]
+    block_size        = config.get('filter_block_size', 100)
+    block             = []
+    # Articles that could not be captured (they will be tried again in the next capture):
+    failed_url_files  = []
     
     # Loop over urls to get articles:
     if gs.debug:
         counter = 0
         print("LOOP over URLs:")        
-    for url_file in url_file_list:
+    fetched = ft.fetch_articles(session, url_file_list, concurrency, timeout, stream)
+    cache   = pc.open_config_cache(config)
+    for (url_file, response), parsed in pp.parse_stream(pp.fetched_bodies(fetched, stream), processes, cache):
         
         # GET one DOU article:
         if gs.debug:
             counter = counter + 1
             print("Get article...", counter)
-        try:
-            get_ok   = False
-            response = session.get(url_file['url'], timeout=15)
-            get_ok   = True      
-        # Warn if GET crashes:
-        except requests.exceptions.ReadTimeout:
-            print('ReadTimeout in GET ' + url_file['url'])
-        except requests.exceptions.ConnectTimeout:
-            print('ConnectTimeout in GET ' + url_file['url'])
-        except:
-            print('Error in GET ' + url_file['url'])
+        # (streamed bodies are only read when parsed):
+        get_ok = response != None and not (response.status_code == 200 and parsed is None)
         
         if get_ok:
             if response.status_code == 200:
                 # SUCCESS in GET!
-                
-                # Parse article into a flexible structure that reads every key (html tag class) in the file:
-                if gs.debug:
-                    print("Parse article...")
-                raw_article = pa.parse_dou_article(response, url_file['url'])
 
-                # Organize article by capturing selected fields:
-                if gs.debug:
-                    print("Select relevant fields...")        
-                article = sa.structure_article(raw_article)
+                # Archive article's raw HTML (so it can be reparsed without downloading it again):
+                if config.get('archive_path') != None:
+                    if gs.debug:
+                        print("Archive article...")
+                    aa.archive_response(config['archive_path'], url_file, response)
+                
+                # Article parsed into a flexible structure that reads every key (html tag class) in the file
+                # and organized by capturing selected fields (see parse_pool.parse_and_structure):
+                raw_article, article = parsed
                 
                 # Write raw article's file to database:
                 wrote_return = 2   # (Preset status of 'save article' operation)
@@ -168,30 +215,48 @@ def capture_DOU_driver(event):
                         elif ds.debug:
                             print('Write_to_s3 failed.')
                             
-                # Loop over filters:
-                if gs.debug:
-                    print("Filtering article...")
-                for i in range(len(bot_infos)):
-                    # Filter article:
-                    relevant_articles[i] = relevant_articles[i] + fa.get_relevant_articles(bot_infos[i], [article])
-                    # Slack crashes if message has more than 50 blocks.
-                    # Avoid this by pre-posting long messages:
-                    if config['post_articles'] and len(relevant_articles[i]) > 20:
-                        if gs.debug:
-                            print('Selected more than 20 articles.')
-                        ps.post_article(config, bot_infos[i], relevant_articles[i])
-                        relevant_articles[i] = []
+                # Filter the articles once a block is complete:
+                block.append(article)
+                if len(block) >= block_size:
+                    if gs.debug:
+                        print("Filtering " + str(len(block)) + " articles...")
+                    add_selected_articles(config, bot_infos, relevant_articles, block, filter_plan.select_block(block))
+                    block = []
 
                 # Record URL in list of captured articles (for now, we will assume that the article always was posted):
                 if captured_article_ok(config['save_articles'], wrote_return==200, config['post_articles'], True):
-                    gu.register_captured_url(config['url_list'], url_file['url'])
-                elif gs.debug:
-                    print('Failed to record as done: ' + url_file['url'])
+                    ur.register_url_file(registry, url_file)
+                else:
+                    failed_url_files.append(url_file)
+                    if gs.debug:
+                        print('Failed to record as done: ' + url_file['url'])
                   
             else:
                 # GET ran but returned BAD STATUS:
                 print('Bad status in GET ' + url_file['url'])  
+                failed_url_files.append(url_file)
+        else:
+            failed_url_files.append(url_file)
     # End of Loop over URLs.
+    
+    # Filter the last block of articles:
+    add_selected_articles(config, bot_infos, relevant_articles, block, filter_plan.select_block(block))
+
+    if gs.debug and cache != None:
+        print('Parse cache:', cache.stats())
+    if gs.debug:
+        print('Filter routing:', filter_plan.routing_stats())
+        print('Filter predicates:', filter_plan.sharing_stats())
+        print('Filter statistics (since the filters were loaded):')
+        for row in filter_plan.report():
+            print(row)
+
+    # Register the captured URLs still in the buffer
+    # (if the capture crashes before this, these articles are captured again next time):
+    registry.flush()
+
+    # Mark articles listed in the index pages as processed:
+    gu.commit_index_snapshots(config, failed_url_files)
 
     if config['post_articles']:
         # Send the selected articles to Slack:
@@ -201,3 +266,94 @@ def capture_DOU_driver(event):
 
     # Return the config for next capture try:
     return next_config
+
+
+def reparse_archive_driver(event, start_date=None, end_date=None):
+    """
+    Run the parse, structure and filter stages of the DOU articles' capture 
+    over the articles stored in the archive (see article_archive.py), 
+    without downloading them again. It receives either a filename (string) 
+    for a configuration file or a configuration as a dict (see 
+    capture_DOU_driver); the keywords used are archive_path, storage_path,
+    save_articles, secao, filter_file, filter_plan_path, filter_block_size,
+    reparse_post_articles, slack_token, parse_processes, parse_cache_size 
+    and parse_cache_path.
+
+    The selected articles are only posted if reparse_post_articles is True
+    (default False; post_articles is ignored, so that a capture's 
+    configuration does not repost old articles).
+
+    Only the articles published between `start_date` and `end_date` 
+    (str, '%Y-%m-%d', inclusive; None means no limit) are reparsed. The 
+    list of captured URLs and the index pages' cache are not changed.
+    Returns the number of reparsed articles.
+    """
+
+    # Load configuration:
+    if type(event) == str:
+        config = gu.load_local_config(event)
+    elif type(event) == dict:
+        config = event
+    else:
+        raise Exception('reparse_archive_driver: unknown input event type.')
+    if config.get('archive_path') is None:
+        raise Exception('reparse_archive_driver: config has no archive_path.')
+    # Only post the reparsed articles if explicitly requested:
+    config = dict(config, post_articles=config.get('reparse_post_articles', False))
+
+    # Get list of archived articles:
+    entries = aa.load_index(config['archive_path'], start_date, end_date)
+    if True or gs.debug:
+        print('# archived articles:', len(entries))
+    if len(entries) == 0:
+        return 0
+    
+    # Load filters:
+    if gs.debug:
+        print("Loading filters...")    
+    filter_plan = fc.compiled_filters(config).for_sections(config['secao'])
+    bot_infos   = filter_plan.bot_infos
+
+    # The lists inside relevant_articles will receive the articles selected by each filter set
+    # (the articles are filtered in blocks of block_size):
+    relevant_articles = [[] for bot_info in bot_infos]
+    block_size        = config.get('filter_block_size', 100)
+    block             = []
+
+    # Loop over archived articles (parsed and structured by parse_processes processes):
+    texts = ((entry, aa.entry_text(config['archive_path'], entry), entry['url']) for entry in entries)
+    cache = pc.open_config_cache(config)
+    for entry, (raw_article, article) in pp.parse_stream(texts, config.get('parse_processes', 1), cache):
+
+        # Write raw article's file to database:
+        if config['save_articles']:
+            if gs.local:
+                wa.write_local_article(config, raw_article, entry['filename'])
+            else:
+                wa.write_to_s3(config, raw_article, entry['filename'])
+
+        # Filter the articles once a block is complete:
+        block.append(article)
+        if len(block) >= block_size:
+            add_selected_articles(config, bot_infos, relevant_articles, block, filter_plan.select_block(block))
+            block = []
+    add_selected_articles(config, bot_infos, relevant_articles, block, filter_plan.select_block(block))
+    if gs.debug and cache != None:
+        print('Parse cache:', cache.stats())
+    if gs.debug:
+        print('Filter routing:', filter_plan.routing_stats())
+        print('Filter predicates:', filter_plan.sharing_stats())
+        print('Filter statistics (since the filters were loaded):')
+        for row in filter_plan.report():
+            print(row)
+    
+    if config['post_articles']:
+        # Send the selected articles to Slack:
+        for i in range(len(bot_infos)):
+            if len(relevant_articles[i]) > 0:
+                ps.post_article(config, bot_infos[i], relevant_articles[i])
+    else:
+        print('# selected articles (not posted):', 
+              [(bot_infos[i]['nome'], len(relevant_articles[i])) for i in range(len(bot_infos))])
+
+    return len(entries)
@@ -0,0 +1,108 @@
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import replay_http as rh
+
+
+def build_session(pool_size=1, max_retries=3):
+    """
+    Create a requests Session whose connection pools to in.gov.br
+    (http and https) can each hold `pool_size` (int) simultaneous
+    connections, with `max_retries` (int) retries for each GET. The
+    session can be shared among threads.
+    """
+    session = requests.Session()
+    # One pool for http and one for https (the article pages redirect to the latter):
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=max(1, pool_size),
+                                            max_retries=max_retries)
+    session.mount('http://www.in.gov.br', adapter)
+    session.mount('https://www.in.gov.br', adapter)
+    return session
+
+
+def config_session(config, pool_size=1, max_retries=3):
+    """
+    Create a requests Session as build_session does, according to the
+    configuration `config` (dict):
+
+    * replay_path: if set, no request goes to in.gov.br: the responses
+                   recorded in this directory are served instead (see 
+                   replay_http.ReplayAdapter);
+    * replay_latency: time in seconds that each replayed request takes
+                      (optional, default 0);
+    * replay_error_rate: probability of a replayed request failing with
+                         a connection error (optional, default 0);
+    * replay_seed: seed of the random latencies and errors (optional, default 0);
+    * record_path: if set, all responses are recorded in this directory,
+                   to be replayed later.
+    """
+    if config.get('replay_path') != None:
+        session = requests.Session()
+        adapter = rh.ReplayAdapter(config['replay_path'], config.get('replay_latency', 0),
+                                   config.get('replay_error_rate', 0), max_retries,
+                                   config.get('replay_seed', 0))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    else:
+        session = build_session(pool_size, max_retries)
+
+    if config.get('record_path') != None:
+        session.hooks['response'].append(rh.record_hook(config['record_path']))
+
+    return session
+
+
+def get_article(session, url, timeout=15, stream=False):
+    """
+    GET the DOU article at `url` (str) using the requests `session`,
+    with a `timeout` (in seconds). Returns the response or None if the
+    GET crashed (a warning is printed in this case). If `stream` is True,
+    only the headers are read (the body is read when used).
+    """
+    try:
+        return session.get(url, timeout=timeout, stream=stream)
+    # Warn if GET crashes:
+    except requests.exceptions.ReadTimeout:
+        print('ReadTimeout in GET ' + url)
+    except requests.exceptions.ConnectTimeout:
+        print('ConnectTimeout in GET ' + url)
+    except:
+        print('Error in GET ' + url)
+    return None
+
+
+def fetch_articles(session, url_file_list, concurrency=1, timeout=15, stream=False):
+    """
+    Generator that GETs the URLs in `url_file_list` (a list of dicts
+    with keys 'url' and 'filename') and yields tuples (url_file, response)
+    in the same order as the input list. `response` is None if the GET
+    crashed. If `stream` is True, the responses' bodies are not read
+    (see get_article).
+
+    If `concurrency` > 1, the GETs are made by a pool of that many threads
+    sharing `session`. Only a window of 2 x `concurrency` requests is kept
+    ahead of the consumer, so responses do not pile up in memory.
+    """
+
+    # Serial mode (one GET at a time):
+    if concurrency <= 1:
+        for url_file in url_file_list:
+            yield url_file, get_article(session, url_file['url'], timeout, stream)
+        return
+
+    # Concurrent mode:
+    window = 2 * concurrency
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending  = deque()
+        url_iter = iter(url_file_list)
+        for url_file in url_iter:
+            pending.append((url_file, executor.submit(get_article, session, url_file['url'], timeout, stream)))
+            if len(pending) >= window:
+                break
+        while len(pending) > 0:
+            url_file, future = pending.popleft()
+            # Keep the window full:
+            next_url_file = next(url_iter, None)
+            if next_url_file != None:
+                pending.append((next_url_file, executor.submit(get_article, session, next_url_file['url'], timeout, stream)))
+            yield url_file, future.result()
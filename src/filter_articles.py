@@ -1,5 +1,8 @@
 import json
+import copy
+import time
 import global_settings as gs
+import keyword_matcher as km
 from collections import defaultdict
 
 def query_bigquery(query):
@@ -57,6 +60,11 @@ def load_local_filters(filter_path):
     return filters_raw
 
 
+# How keywords and articles' fields are compared, by filter match_mode: 
+# 'exact' (default) ignores case; 'normalized' ignores case and accents:
+match_functions = {'exact': str.lower, 'normalized': km.normalize}
+
+
 def csvrow_to_list(csvrow):
     """
     Takes a string 'csvrow' that has substrings separated by semicolons and 
@@ -74,10 +82,10 @@ def check_for_ambiguity(filter_group, filter_ids, key):
     (nome, casa, channel, description). Returns an error if it 
     doesn't. This is needed to group filters under the same 
     filter set.
-    -- filter_group: pandas grouby object, grouped by filter number.
+    -- filter_group: dict of lists of filters, grouped by filter number.
     -- key: nome, casa, channel, description
     """
-    unique_key = all([[f[key] == filter_group[i][0][key] for f in filter_group[i]] for i in filter_ids])
+    unique_key = all([f[key] == filter_group[i][0][key] for i in filter_ids for f in filter_group[i]])
     if not unique_key:
         raise Exception('Found multiple entries of \''+key+'\' for same filter.')
 
@@ -103,9 +111,23 @@ def filterset_gen(filters_raw, fnumber):
             return []
     else:
         # If there are filters, group them:
-        return [{k:(f[k] if k=='column_name' else csvrow_to_list(f[k])) 
-                 for k in ('column_name', 'positive_filter', 'negative_filter') if f[k]!=None} 
-                for f in filters_raw if f['filter_number'] == fnumber]
+        return [format_filter(f) for f in filters_raw if f['filter_number'] == fnumber]
+
+
+def format_filter(f):
+    """
+    Take a filter entry `f` (dict) and return the filter (dict) with its
+    column_name and its positive and negative filters as lists of keywords
+    (only the non-missing ones), and its match_mode if given (see 
+    match_functions).
+    """
+    formatted = {k:(f[k] if k=='column_name' else csvrow_to_list(f[k])) 
+                 for k in ('column_name', 'positive_filter', 'negative_filter') if f[k]!=None}
+    if f.get('match_mode') != None:
+        if f['match_mode'] not in match_functions:
+            raise Exception('Unknown match_mode \''+str(f['match_mode'])+'\' in filter '+str(f['filter_number'])+'.')
+        formatted['match_mode'] = f['match_mode']
+    return formatted
 
 
 def format_filters(filters_raw):
@@ -127,8 +149,8 @@ def format_filters(filters_raw):
     # Get filter set tags:
     filter_tag = {key: get_filter_par(filter_group, filter_ids, key) for key in filter_id_keys}
 
-    # Organize filters in a filter set:
-    filter_set = [filterset_gen(filters_raw, fnumber) for fnumber in filter_ids]
+    # Organize filters in a filter set (each group only has the filters with its filter_number):
+    filter_set = [filterset_gen(filter_group[fnumber], fnumber) for fnumber in filter_ids]
 
     # Put all filter sets (with tags) into a list:
     event = [{'nome': filter_tag['nome'][i], 
@@ -257,15 +279,18 @@ def get_relevant_articles(bot_info, articles):
             # Select all desired columns that actually exist in the bigquery results:
             articles = list(filter(lambda x: x[f['column_name']] is not None, articles))
                 
+            # Function used to compare keywords and text:
+            match = match_functions[f.get('match_mode', 'exact')]
+
             if 'positive_filter' in f.keys():
                 articles = list(filter(lambda x: 
-                    any([var.lower() in x[f['column_name']].lower() 
+                    any([match(var) in match(x[f['column_name']]) 
                         for var in f['positive_filter']]), articles))
                         
             # Changed on 2019-05-21 from elif to if:
             if 'negative_filter' in f.keys():
                 articles = list(filter(lambda x: 
-                    all([var.lower() not in x[f['column_name']].lower() 
+                    all([match(var) not in match(x[f['column_name']]) 
                         for var in f['negative_filter']]), articles))
 
             Narticles = len(articles)
@@ -276,3 +301,324 @@ def get_relevant_articles(bot_info, articles):
                 return articles
                 
     return articles
+
+
+# Version of the compiled filters' format (increase it whenever FilterPlan changes,
+# so compiled filters stored on disk are not reused; see filter_cache.py):
+FILTER_PLAN_VERSION = 5
+
+# Columns with short values (e.g. a section number or the agency's name), that are
+# cheap to check (used to order the filters before any statistics are gathered):
+short_columns = ['secao', 'orgao', 'assina', 'identifica', 'cargo', 'pagina', 'edicao', 'pub_date', 'assinaPr']
+
+# Columns with few distinct values, whose filters are evaluated once per value
+# to route each article to the filter sets that can select it:
+routing_columns = ['secao', 'orgao']
+
+
+class FilterPlan:
+    """
+    Filter sets `bot_infos` (list of dicts, see format_filters) compiled
+    for selecting articles: the keywords of all filters over each column
+    (and match mode, see match_functions) are matched at once (see 
+    keyword_matcher.KeywordMatcher), in a single pass over the article's 
+    lowercased or normalized field, instead of one scan per keyword, filter
+    and filter set. The selection is the same as get_relevant_articles'.
+
+    Since the filters in a set are combined with AND, they are evaluated
+    from the cheapest and most selective to the most expensive and least
+    selective, according to the statistics of their evaluations (number
+    of evaluations, passes and time), which are recorded for every
+    filter (see report). The filters are reordered every
+    `reorder_interval` articles (None for the order in the filter file).
+
+    Before that, the article is routed by its section and agency (the
+    `routing_columns`): the filters over these columns are evaluated 
+    once for each value (then remembered) for all filter sets, giving
+    the filter sets that accept that value as a bitmask. Only the filter
+    sets accepted by both masks (the candidates) are evaluated over the
+    remaining columns.
+
+    Identical filters (same column, keywords and match mode) in different filter sets
+    are compiled into a single predicate, evaluated at most once per 
+    article (or routed value) and shared by all filter sets that use it.
+    The statistics are recorded per predicate.
+    """
+
+    def __init__(self, bot_infos, reorder_interval=1000):
+        self.bot_infos = bot_infos
+        self.reorder_interval = reorder_interval
+        # (the filter ids below refer to these filter sets, even in subsets of this plan):
+        self.compiled_bot_infos = bot_infos
+        
+        # Gather the keywords (lowercased or normalized, see match_functions) used over each column:
+        keywords = defaultdict(set)
+        for bot_info in bot_infos:
+            for f in bot_info['filters']:
+                mode = f.get('match_mode', 'exact')
+                for key in ('positive_filter', 'negative_filter'):
+                    keywords[(f['column_name'], mode)].update([match_functions[mode](var) for var in f.get(key, [])])
+        self.matchers = {column_mode: km.KeywordMatcher(words) for column_mode, words in keywords.items()}
+        
+        # Filters as predicates (predicate id, column, positive keywords or None, negative keywords or None, 
+        # match mode), where identical filters share the same predicate:
+        self.filter_sets = []
+        predicate_ids    = {}
+        # Filters (filter set, position in the set) that use each predicate:
+        self.predicate_users = []
+        for i, bot_info in enumerate(bot_infos):
+            filters = []
+            for j, f in enumerate(bot_info['filters']):
+                mode  = f.get('match_mode', 'exact')
+                match = match_functions[mode]
+                key   = (f['column_name'], 
+                         frozenset([match(var) for var in f['positive_filter']]) if 'positive_filter' in f.keys() else None,
+                         frozenset([match(var) for var in f['negative_filter']]) if 'negative_filter' in f.keys() else None,
+                         mode)
+                if key not in predicate_ids:
+                    predicate_ids[key] = len(self.predicate_users)
+                    self.predicate_users.append([])
+                self.predicate_users[predicate_ids[key]].append((i, j))
+                filters.append((predicate_ids[key],) + key)
+            self.filter_sets.append(filters)
+        
+        # Evaluation statistics of each predicate (by predicate id; shared with the subsets of this plan),
+        # where `reused` counts the evaluations avoided by sharing the predicate:
+        self.stats     = [{'evals': 0, 'passes': 0, 'time': 0.0, 'reused': 0} for users in self.predicate_users]
+        self.narticles = 0
+
+        # Routing: bitmask (over the compiled filter sets) of the filter sets that accept each
+        # value of the routing columns used by the filters (shared with the subsets of this plan):
+        self.compiled_sets = self.filter_sets
+        self.routes  = {column: {} for column in routing_columns if column in [c for c, mode in keywords]}
+        self.routing = {'articles': 0, 'candidates': 0, 'values': 0}
+        # Compiled filter set of each filter set in this plan (by position) and vice-versa:
+        self.set_ids       = list(range(len(bot_infos)))
+        self.set_positions = {cid: i for i, cid in enumerate(self.set_ids)}
+        self.set_mask      = (1 << len(bot_infos)) - 1
+        self.reorder()
+
+    def select(self, article):
+        """
+        Return the list of indices (int, in increasing order) of the filter 
+        sets in `bot_infos` that select the `article` (dict, see 
+        structure_article), i.e. the ones for which get_relevant_articles
+        would return it.
+        """
+        # Filter sets that accept the article's section and agency:
+        candidates = self.set_mask
+        for column in self.routes:
+            candidates = candidates & self.route(column, article[column])
+        self.routing['articles']   = self.routing['articles'] + 1
+        self.routing['candidates'] = self.routing['candidates'] + bin(candidates).count('1')
+        
+        # Keywords found in each column of the article (computed when first needed)
+        # and results of the predicates already evaluated:
+        found   = {}
+        results = {}
+        
+        selected = []
+        while candidates != 0:
+            # Next candidate (lowest bit):
+            cid = (candidates & -candidates).bit_length() - 1
+            candidates = candidates & (candidates - 1)
+            i = self.set_positions[cid]
+            for pid, column, positive, negative, mode in self.unrouted_sets[i]:
+                passed = self.evaluate(pid, article, column, positive, negative, mode, found, results)
+                if not passed:
+                    break
+            else:
+                selected.append(i)
+        
+        self.narticles = self.narticles + 1
+        if self.reorder_interval != None and self.narticles % self.reorder_interval == 0:
+            self.reorder()
+        return selected
+
+    def select_block(self, articles):
+        """
+        Return, for each filter set in `bot_infos`, the list of indices 
+        (int, in increasing order) of the articles in the block `articles`
+        (list of dicts, see structure_article) that it selects.
+        """
+        selections = [[] for bot_info in self.bot_infos]
+        for k, article in enumerate(articles):
+            for i in self.select(article):
+                selections[i].append(k)
+        return selections
+
+    def passes(self, article, column, positive, negative, mode, found):
+        """
+        Return True if the `article` (dict) passes the predicate over `column`
+        (str) with `positive` and `negative` keywords (sets of str or None)
+        compared in match `mode` (see match_functions), False otherwise.
+        `found` (dict) caches the keywords found in each column of this 
+        article, so each field is lowercased or normalized only once.
+        """
+        # Articles with missing values are dropped:
+        if article[column] is None:
+            return False
+        column_mode = (column, mode)
+        if column_mode not in found and (positive != None or negative != None):
+            found[column_mode] = self.matchers[column_mode].find(match_functions[mode](article[column]))
+        if positive != None and positive.isdisjoint(found[column_mode]):
+            return False
+        if negative != None and not negative.isdisjoint(found[column_mode]):
+            return False
+        return True
+
+    def evaluate(self, pid, article, column, positive, negative, mode, found, results):
+        """
+        Return whether the `article` passes the predicate `pid` (see passes), 
+        taking it from `results` (dict of the predicates already evaluated 
+        for this article) if possible and recording its statistics.
+        """
+        passed = results.get(pid)
+        if passed is None:
+            t0 = time.perf_counter()
+            passed = self.passes(article, column, positive, negative, mode, found)
+            self.record(pid, passed, time.perf_counter() - t0)
+            results[pid] = passed
+        else:
+            self.stats[pid]['reused'] = self.stats[pid]['reused'] + 1
+        return passed
+
+    def route(self, column, value):
+        """
+        Return the bitmask (int) of the compiled filter sets whose filters
+        over the routing `column` (str) accept the `value` (str or None), 
+        evaluating them if this value was not seen before.
+        """
+        mask = self.routes[column].get(value)
+        if mask is None:
+            mask    = 0
+            found   = {}
+            results = {}
+            for cid, filters in enumerate(self.compiled_sets):
+                accepted = True
+                for pid, filter_column, positive, negative, mode in filters:
+                    if filter_column == column:
+                        passed   = self.evaluate(pid, {column: value}, column, positive, negative, mode, found, results)
+                        accepted = accepted and passed
+                if accepted:
+                    mask = mask | (1 << cid)
+            self.routes[column][value] = mask
+            self.routing['values'] = self.routing['values'] + 1
+        return mask
+
+    def record(self, pid, passed, seconds):
+        """
+        Add an evaluation of predicate `pid` (that `passed` or not and took
+        `seconds`) to its statistics.
+        """
+        stats = self.stats[pid]
+        stats['evals']  = stats['evals'] + 1
+        stats['passes'] = stats['passes'] + passed
+        stats['time']   = stats['time'] + seconds
+
+    def rank(self, pid, column):
+        """
+        Return the rank (float) of the predicate `pid` over `column` in the 
+        evaluation order: the expected time spent on it per article it 
+        rejects, estimated from its statistics (starting from a guess 
+        based on the column).
+        """
+        stats = self.stats[pid]
+        # Guessed time (s) and weight of the guess (in number of evaluations):
+        guess = 1e-6 if column in short_columns else 1e-4
+        cost  = (stats['time'] + 5 * guess) / (stats['evals'] + 5)
+        pass_rate = (stats['passes'] + 1) / (stats['evals'] + 2)
+        return cost / (1 - pass_rate)
+
+    def reorder(self):
+        """
+        Sort the filters in each filter set by their rank (see rank) and
+        list the ones evaluated for each candidate article (the ones not
+        over the routing columns).
+        """
+        if self.reorder_interval != None:
+            self.filter_sets = [sorted(filters, key=lambda f: self.rank(f[0], f[1])) for filters in self.filter_sets]
+        self.unrouted_sets = [[f for f in filters if f[1] not in self.routes] for filters in self.filter_sets]
+
+    def report(self):
+        """
+        Return the evaluation statistics of the predicates used by this 
+        plan as a list of dicts (one per predicate, sorted by total time) 
+        with keys predicate (id), column_name, used_by (list of the filters
+        that share it, as 'filter set name [position in the set]'), evals,
+        reused (evaluations avoided by sharing), passes, pass_rate, time (s),
+        time_share and routed (predicates over the routing columns, 
+        evaluated once per value).
+        """
+        pids  = sorted(set([f[0] for filters in self.filter_sets for f in filters]))
+        total = sum([self.stats[pid]['time'] for pid in pids])
+        rows  = []
+        for pid in pids:
+            stats  = self.stats[pid]
+            i, j   = self.predicate_users[pid][0]
+            column = self.compiled_bot_infos[i]['filters'][j]['column_name']
+            rows.append({'predicate': pid, 'column_name': column,
+                         'used_by': [self.compiled_bot_infos[i]['nome'] + ' [' + str(j) + ']' for i, j in self.predicate_users[pid]],
+                         'evals': stats['evals'], 'reused': stats['reused'], 'passes': stats['passes'],
+                         'pass_rate': round(stats['passes'] / stats['evals'], 4) if stats['evals'] > 0 else None,
+                         'time': round(stats['time'], 6),
+                         'time_share': round(stats['time'] / total, 4) if total > 0 else 0.0,
+                         'routed': column in self.routes})
+        return sorted(rows, key=lambda row: -row['time'])
+
+    def sharing_stats(self):
+        """
+        Return a dict with the number of filters and of distinct predicates
+        in this plan, the number of predicate evaluations and of evaluations
+        avoided by sharing predicates among filter sets (reused), and the
+        fraction of evaluations avoided (saved).
+        """
+        pids   = set([f[0] for filters in self.filter_sets for f in filters])
+        evals  = sum([self.stats[pid]['evals'] for pid in pids])
+        reused = sum([self.stats[pid]['reused'] for pid in pids])
+        return {'filters': sum([len(filters) for filters in self.filter_sets]), 'predicates': len(pids),
+                'evals': evals, 'reused': reused, 
+                'saved': round(reused / (evals + reused), 4) if evals + reused > 0 else 0.0}
+
+    def subset(self, indices):
+        """
+        Return a FilterPlan with only the filter sets in positions `indices`
+        (list of int), sharing this plan's compiled keyword matchers and
+        filter statistics.
+        """
+        plan = copy.copy(self)
+        plan.bot_infos     = [self.bot_infos[i] for i in indices]
+        plan.filter_sets   = [self.filter_sets[i] for i in indices]
+        plan.set_ids       = [self.set_ids[i] for i in indices]
+        plan.set_positions = {cid: i for i, cid in enumerate(plan.set_ids)}
+        plan.set_mask      = sum([1 << cid for cid in plan.set_ids])
+        plan.reorder()
+        return plan
+
+    def routing_stats(self):
+        """
+        Return a dict with the number of routed articles, the mean number
+        of candidate filter sets per article (out of the number of filter
+        sets in this plan) and the number of distinct values routed.
+        """
+        return {'articles': self.routing['articles'], 'filter_sets': len(self.bot_infos),
+                'mean_candidates': round(self.routing['candidates'] / self.routing['articles'], 4) if self.routing['articles'] > 0 else 0.0,
+                'values': self.routing['values']}
+
+    def for_sections(self, config_secao):
+        """
+        Return a FilterPlan without the filter sets (that need to be
+        satisfied to select articles) that eliminate all DOU sections
+        to be downloaded, `config_secao` (e.g. config['secao'] = 
+        [1,2,3,'e','1a']; see secao_left).
+        """
+        return self.subset([i for i, bot_info in enumerate(self.bot_infos) if len(secao_left(config_secao, bot_info)) > 0])
+
+
+def compile_filters(bot_infos, reorder_interval=1000):
+    """
+    Return the FilterPlan for the list of filter sets `bot_infos` (see 
+    format_filters), reordering the filters every `reorder_interval` 
+    articles (None to keep the filter file's order).
+    """
+    return FilterPlan(bot_infos, reorder_interval)
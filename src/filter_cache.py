@@ -0,0 +1,98 @@
+import json
+import pickle
+import hashlib
+import os
+import global_settings as gs
+import filter_articles as fa
+
+
+# Compiled filters loaded by this process (e.g. by the scheduler in previous
+# captures), by fingerprint:
+loaded_plans = {}
+
+
+def filters_fingerprint(content):
+    """
+    Return the fingerprint (str) of the filters whose source (the JSON
+    filter file or the query result serialized as JSON) is the bytes
+    `content`, which also depends on the compiled filters' format version.
+    """
+    return hashlib.sha1(str(fa.FILTER_PLAN_VERSION).encode('utf-8') + b'\n' + content).hexdigest()
+
+
+def plan_filename(cache_path, fingerprint):
+    """
+    Return the path of the file in the directory `cache_path` (str) that
+    stores the compiled filters with `fingerprint` (str).
+    """
+    return os.path.join(cache_path, fingerprint + '.pkl')
+
+
+def save_plan(cache_path, fingerprint, plan):
+    """
+    Store the compiled filters `plan` (filter_articles.FilterPlan) with
+    `fingerprint` (str) in the directory `cache_path`. The file is
+    replaced atomically.
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    filename = plan_filename(cache_path, fingerprint)
+    with open(filename + '.tmp', 'wb') as f:
+        pickle.dump(plan, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def load_plan(cache_path, fingerprint):
+    """
+    Return the compiled filters (filter_articles.FilterPlan) with
+    `fingerprint` (str) stored in the directory `cache_path`, or None
+    if they are not there.
+    """
+    filename = plan_filename(cache_path, fingerprint)
+    if os.path.isfile(filename) == False:
+        return None
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def compiled_filters(config):
+    """
+    Return the compiled filters (filter_articles.FilterPlan) of all filter
+    sets given by the configuration `config` (dict): the filter file in
+    config['filter_file'] (local version) or the filters in BigQuery.
+
+    The filters are only formatted (see filter_articles.format_filters)
+    and compiled again if their source changed: the last compiled filters
+    are kept in memory (e.g. for the scheduler's next capture) and, if
+    config['filter_plan_path'] is set, stored in that directory.
+    """
+    # Get the filters' source:
+    if gs.local:
+        with open(config['filter_file'], 'rb') as f:
+            content = f.read()
+        filters_raw = None
+    else:
+        filters_raw = fa.load_remote_filters()
+        content     = json.dumps(filters_raw, sort_keys=True, default=str).encode('utf-8')
+    fingerprint = filters_fingerprint(content)
+    cache_path  = config.get('filter_plan_path')
+
+    # Look for the compiled filters:
+    plan = loaded_plans.get(fingerprint)
+    if plan is None and cache_path != None:
+        plan = load_plan(cache_path, fingerprint)
+        if gs.debug and plan != None:
+            print('Loaded compiled filters ' + fingerprint)
+    if plan is None:
+        if gs.debug:
+            print('Compiling filters ' + fingerprint)
+        if filters_raw is None:
+            filters_raw = fa.load_local_filters(config['filter_file'])
+        plan = fa.compile_filters(fa.format_filters(filters_raw))
+        if cache_path != None:
+            save_plan(cache_path, fingerprint, plan)
+
+    # Only keep the filters currently in use:
+    loaded_plans.clear()
+    loaded_plans[fingerprint] = plan
+    return plan
+
@@ -1,17 +1,26 @@
 # -*- coding: utf-8 -*-
 
-import requests
 from lxml import html
+from lxml import etree
 import json
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import global_settings as gs
-import os
+import fetch_articles as ft
+import index_cache as ic
+import url_registry as ur
 
 if not gs.local:
     import boto3                                  
     from dynamodb_json import json_util as dyjson
 
 
+# Compiled selectors of the JSON with the articles in an index page (by the
+# id index of the parsed document, with a search as fallback):
+params_by_id  = etree.XPath('id("params")/text()', smart_strings=False)
+params_search = etree.XPath('//*[@id="params"]/text()', smart_strings=False)
+
+
 def daterange(start_date, end_date):
     """
     Works the same as python's 'range' but for datetime in days.
@@ -21,14 +30,13 @@ def daterange(start_date, end_date):
         yield start_date + dt.timedelta(n)
 
 
-def get_artigos_do(data, secao):
+def request_index_page(data, secao, session=None, headers=None):
     """
-    For a date (datetime) 'data' and a DOU section 'secao', 
-    retuns a list of jsons with all links to that day and section's
-    articles, along with some metadata.
-    
-    If no articles exist for a certain date and/or section, 
-    if returns an empty list.
+    For a date (datetime) 'data' and a DOU section 'secao', GET the
+    DOU index page (leiturajornal) that lists that day and section's
+    articles and return the response. An existing requests 'session'
+    can be provided to reuse its connections, and extra HTTP 'headers'
+    (dict) can be sent (e.g. for conditional requests).
     """
 
     # Hard-coded:
@@ -43,16 +51,40 @@ def get_artigos_do(data, secao):
     url = url_prefix + data_string + url_sec_sel + str(secao)
     
     # Specifies number of retries for GET:
-    session = requests.Session()
-    session.mount('http://www.in.gov.br', requests.adapters.HTTPAdapter(max_retries=3))
+    if session is None:
+        session = ft.build_session()
     
     # Captura a lista de artigos daquele dia e seção:
-    res   = session.get(url, timeout=10)
+    return session.get(url, timeout=10, headers=headers)
+
+
+def parse_index_page(content):
+    """
+    Given the body (bytes) 'content' of a DOU index page (leiturajornal),
+    return the list of jsons with all links to the articles, along with 
+    some metadata.
+    """
+    tree   = html.fromstring(content)
+    params = params_by_id(tree)
+    if len(params) == 0:
+        params = params_search(tree)
+    return json.loads(params[0])['jsonArray']
+
+
+def get_artigos_do(data, secao, session=None):
+    """
+    For a date (datetime) 'data' and a DOU section 'secao', 
+    retuns a list of jsons with all links to that day and section's
+    articles, along with some metadata. An existing requests 'session'
+    can be provided to reuse its connections.
+    
+    If no articles exist for a certain date and/or section, 
+    if returns an empty list.
+    """
+    res = request_index_page(data, secao, session)
     if res.status_code != 200:
         raise Exception('http GET request failed with code '+str(res.status_code)+'!')
-    tree  = html.fromstring(res.content)
-    xpath = '//*[@id="params"]/text()'
-    return json.loads(tree.xpath(xpath)[0])['jsonArray']
+    return parse_index_page(res.content)
 
 
 def fix_filename(urlTitle):
@@ -96,166 +128,186 @@ def build_filename(date, secao, urlTitle, hive_partitioning=False):
     return prefix + date.strftime('%Y-%m-%d') + '_s' + str(secao) + '_' + fix_filename(urlTitle) + '.json'
 
 
+def brasilia_now():
+    """
+    No matter where the code is ran, return UTC-3 time
+    (Brasilia local time, no daylight savings)
+    """
+    return dt.datetime.utcnow() + dt.timedelta(hours=-3)
+
+
 def brasilia_day():
     """
     No matter where the code is ran, return UTC-3 day
     (Brasilia local day, no daylight savings)
     """
-    return (dt.datetime.utcnow() + dt.timedelta(hours=-3)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return brasilia_now().replace(hour=0, minute=0, second=0, microsecond=0)
 
 
-def load_captured_urls_aws(table_name):
+def build_url_files(date, secao, jsons):
     """
-    Load items from the AWS dynamoDB table `table_name` as entries in a list
-    and return list.
+    Given a date (datetime), a DOU section 'secao' and the list of jsons
+    'jsons' describing the articles in that day and section (see 
+    get_artigos_do), return a list of dicts with the articles' URLs 
+    and filenames (along with the date, section and urlTitle that 
+    identify the article in the index page).
     """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
+    # Hard-coded stuff:
+    url_prefix = 'http://www.in.gov.br/web/dou/-/'
 
-    # Get all items (following pagination if necessary):
-    response = table.scan()
-    data = response['Items']
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        data.extend(response['Items'])
-    
-    # Format data as a list of URLs:
-    url_list = [d['url'] for d in data]
-    
-    return url_list
+    url_file_list = []
+    for j in jsons:
+        url      = url_prefix + j['urlTitle']
+        filename = build_filename(date, secao, j['urlTitle'])
+        url_file_list.append({'url':url, 'filename':filename, 'date': date.strftime('%Y-%m-%d'), 
+                              'secao': str(secao), 'urlTitle': j['urlTitle']})
+    return url_file_list
 
 
-def load_captured_urls_local(filename):
-    """
-    Load lines in the file `filename` as entries in a list
-    and return list. Return empty list if file is not found.
+def get_index_url_files(date, secao, session, config):
     """
-    if os.path.isfile(filename) == False:
-        return []
-    
-    with open(filename, 'r') as f:
-        return f.read().splitlines()
+    Return the list of dicts with URLs and filenames of the DOU articles
+    published on `date` (datetime) in section `secao` (str), using the 
+    requests `session`.
 
+    If config['index_cache_path'] is set, the index page is cached in that
+    directory: the cached list is returned without any request if the page
+    was fetched at least config['index_cache_settle_days'] days after its 
+    date (default 2); otherwise a conditional GET is sent and, if the page
+    did not change (HTTP 304 or same content hash), the cached list is 
+    returned without parsing the page again.
 
-def load_captured_urls(url_list):
+    If config['index_diff'] is True, only the articles that were not in the
+    last committed snapshot of the page are returned (see get_new_url_files).
     """
-    Load list of urls from local or remote (AWS) source, according to 
-    global variable gs.local. `url_list` is string that is either 
-    a file path or a DynamoDB table name.
-    """
-    if gs.local:
-        result = load_captured_urls_local(url_list)
-    else:
-        result = load_captured_urls_aws(url_list)
-    return result
-
+    cache_path = config.get('index_cache_path')
+    
+    # No cache:
+    if cache_path is None:
+        return build_url_files(date, secao, get_artigos_do(date, secao, session))
+
+    # Only return new articles:
+    if config.get('index_diff', False):
+        return get_new_url_files(date, secao, session, config)
+
+    # Past days do not change after some time:
+    now   = brasilia_now()
+    entry = ic.load_entry(cache_path, date, secao)
+    if ic.is_settled(entry, date, config.get('index_cache_settle_days', 2), now):
+        return entry['url_files']
+
+    # Only download the page if it changed:
+    res = request_index_page(date, secao, session, ic.conditional_headers(entry))
+    if res.status_code == 304 and entry != None:
+        ic.save_entry(cache_path, date, secao, ic.refresh_entry(entry, res, now))
+        return entry['url_files']
+    if res.status_code != 200:
+        raise Exception('http GET request failed with code '+str(res.status_code)+'!')
+    if entry != None and entry['content_hash'] == ic.content_hash(res.content):
+        ic.save_entry(cache_path, date, secao, ic.refresh_entry(entry, res, now))
+        return entry['url_files']
 
-def register_captured_url_aws(table_name, url):
-    """
-    Put the `url` (str) as a new item in AWS DynamoDB table 
-    `table_name` (str).
-    """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
+    # The page changed, parse it:
+    url_files = build_url_files(date, secao, parse_index_page(res.content))
+    ic.save_entry(cache_path, date, secao, ic.new_entry(res, url_files, now))
+    return url_files
 
-    # Escreve os dicionários criados pela função generate_body na tabela do dynamo: 
-    with table.batch_writer() as batch:
-        batch.put_item(Item={'url': url})
-        
 
-def register_captured_url_local(filename, url):
+def get_new_url_files(date, secao, session, config):
     """
-    Append `url` (str) as a new line to the file `filename`.
-    """
-    with open(filename, 'a') as f:
-        f.write(url + '\n')
-
+    Return the list of dicts with URLs and filenames of the DOU articles
+    published on `date` (datetime) in section `secao` (str) that were 
+    added to the index page since its last committed snapshot, stored in 
+    the directory config['index_cache_path']. Articles whose metadata 
+    changed or that were removed from the page are reported.
 
-def register_captured_url(url_list, url):
+    The new snapshot is saved as pending: it must be committed with
+    commit_index_snapshots once the articles were processed.
     """
-    Append `url` (str) to `url_list`, which is either 
-    a local file or an AWS DynamoDB table (according to 
-    global variable gs.local).
-    """    
-    if gs.local:
-        register_captured_url_local(url_list, url)
-    else:
-        register_captured_url_aws(url_list, url)
+    cache_path = config['index_cache_path']
     
-        
-def erase_captured_urls_aws(table_name):
-    """
-    Erase all items found in DynamoDB table with name 
-    `table_name`.
-    """
-    # Pega a referência (pointer) da tabela do dynamo:    
-    dynamodb = boto3.resource('dynamodb')
-    table    = dynamodb.Table(table_name)
-
-    # Get all items (following pagination if necessary):
-    response = table.scan()
-    data = response['Items']
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        data.extend(response['Items'])
+    # Skip the page if it did not change since the last snapshot:
+    now      = brasilia_now()
+    snapshot = ic.load_snapshot(cache_path, date, secao)
+    if ic.is_settled(snapshot, date, config.get('index_cache_settle_days', 2), now):
+        return []
+    res = request_index_page(date, secao, session, ic.conditional_headers(snapshot))
+    if res.status_code == 304 and snapshot != None:
+        return []
+    if res.status_code != 200:
+        raise Exception('http GET request failed with code '+str(res.status_code)+'!')
+    if snapshot != None and snapshot['content_hash'] == ic.content_hash(res.content):
+        return []
 
-    # Delete all items:
-    with table.batch_writer() as batch:
-        for each in data:
-            batch.delete_item(Key=each)
+    # Compare the page to the last snapshot:
+    jsons        = parse_index_page(res.content)
+    new_snapshot = ic.new_snapshot(res, jsons, now)
+    added, changed, removed = ic.diff_snapshots(snapshot, new_snapshot)
+    ic.save_snapshot(cache_path, date, secao, new_snapshot, pending=True)
+    
+    # Report changes:
+    if len(changed) > 0 or len(removed) > 0:
+        print('Index ' + date.strftime('%Y-%m-%d') + ' s' + str(secao) + ': ' + str(len(added)) + ' added, ' + 
+              str(len(changed)) + ' changed, ' + str(len(removed)) + ' removed.')
+        if gs.debug:
+            print('Changed:', changed)
+            print('Removed:', removed)
+    
+    added = set(added)
+    return build_url_files(date, secao, [j for j in jsons if j['urlTitle'] in added])
 
 
-def erase_captured_urls_local(filename):
+def commit_index_snapshots(config, failed_url_files=None):
     """
-    Erase the contant of `filename`.
+    If config['index_diff'] is True, mark the articles listed in the index
+    pages downloaded by the last call to get_articles_url as processed, 
+    except for those in `failed_url_files` (list of dicts created by 
+    build_url_files), which will be returned again by the next call.
     """
-    with open(filename, 'w') as f:
-        f.write('')
+    if not config.get('index_diff', False):
+        return
+    cache_path = config['index_cache_path']
+    if failed_url_files != None:
+        ic.drop_pending_articles(cache_path, failed_url_files)
+    ic.commit_snapshots(cache_path)
 
-        
-def erase_captured_urls(url_list):
-    """
-    Erase list of URLs stored in `url_list`, which 
-    might be a local filename or a DynamoDB table name
-    (according to global variable gs.local).
-    """
-    if gs.local:
-        erase_captured_urls_local(url_list)
-    else:
-        erase_captured_urls_aws(url_list)
 
-        
-def filter_captured_urls(urls_files, url_list_file):
+def filter_captured_urls(urls_files, url_list_file, registry=None):
     """
     Given a list of dicts `urls_files` containing URLs and filenames 
-    and a list of URLs stored in the file `url_list_file`, 
-    return a list of the dicts whose URLs are not listed in the file.
-    """
-    captured_urls = load_captured_urls(url_list_file)
-    
-    to_capture = list(filter(lambda d: d['url'] not in captured_urls, urls_files))
+    and a list of URLs stored in the file (or DynamoDB table) 
+    `url_list_file`, return a list of the dicts whose URLs are not 
+    listed in the file. An already opened `registry` of captured URLs
+    (see url_registry) can be given instead of loading `url_list_file`.
+    """
+    if registry is None:
+        registry = ur.open_registry(url_list_file)
+    to_capture = ur.filter_new(registry, urls_files)
     
     return to_capture
 
 
-def update_config(config, Nurls):
+def update_config(config, Nurls, registry=None):
     """
     Given a config file for capturing DOU articles' URLs and the number of
     articles that sgould be downloaded prior to batch size limitations `Nurls`,
-    return an updated config for the next request try. 
+    return an updated config for the next request try. If the captured URLs 
+    list must be erased, it is done through `registry` (see url_registry), 
+    if given.
     
     Required config keys:
     * end_date    > The articles' date to request the URLs;
     * date_format > The format of the date above (e.g. %Y-%m-%d);
-    * timedelta   > Current implementation requires this to be 0;
+    * timedelta   > Current implementation requires this to be 0 (unless url_list_partitioned is True);
     * url_list    > filename (or DynamoDB table name) where a list of captured URLs is stored;
-    * daily_clean_url_list > Whether or not to erase the content of url_list once the current day change.
+    * daily_clean_url_list > Whether or not to erase the content of url_list once the current day change
+                             (if url_list_partitioned is True, only partitions older than url_list_keep_days
+                             days before the next capture are erased).
     """
     
-    if config['timedelta'] != 0:
-        raise Exception('current implementation only allows timedelta=0.')
+    partitioned = config.get('url_list_partitioned', False)
+    if config['timedelta'] != 0 and not partitioned:
+        raise Exception('current implementation only allows timedelta=0 (unless url_list_partitioned is True).')
     
     # Copy config:
     config2  = dict(config)
@@ -271,15 +323,23 @@ def update_config(config, Nurls):
     
     # If end_date is in the past, return next day and clean captured URLs list (if requested):
     if end_date < brasilia_day():
+        next_date = end_date + dt.timedelta(days=1)
         if config['daily_clean_url_list'] == True:
-            erase_captured_urls(config['url_list'])
-        config2['end_date'] = (end_date + dt.timedelta(days=1)).strftime(config['date_format'])
+            if registry is None:
+                registry = ur.open_config_registry(config)
+            if partitioned:
+                # Keep the partitions of the next capture's date range:
+                keep_days = max(config.get('url_list_keep_days', 7), -config['timedelta'])
+                registry.expire(next_date - dt.timedelta(days=keep_days))
+            else:
+                registry.erase()
+        config2['end_date'] = next_date.strftime(config['date_format'])
         return config2
             
     return config2
 
 
-def get_articles_url(config):
+def get_articles_url(config, registry=None):
     """
     Get as input a dict 'config' with keys:
     
@@ -289,13 +349,21 @@ def get_articles_url(config):
     * 'timedelta':   number of days from end_date to start URL search (is a negative number);
     * 'url_list':    filename or dynamoDB table name of a list of captured URLs (to avoid capturing again).
     * 'daily_clean_url_list': whether or not to erase 'url_list' every day.
-
-    and creates a list of DOU articles' URLs to download. 
+    * 'index_concurrency': number of date x section index pages downloaded simultaneously
+                           (optional, default 1).
+    * 'index_cache_path': directory where to cache the index pages (optional, default: no cache);
+    * 'index_cache_settle_days': number of days after which a day's index page is considered
+                                 immutable (optional, default 2).
+    * 'index_diff': whether or not to only return articles that were added to the index pages 
+                    since the last capture (optional, default False; requires 'index_cache_path').
+    * 'replay_path', 'replay_latency', 'replay_error_rate', 'replay_seed', 'record_path': serve the 
+      index pages from (or record them to) a local directory (optional, see fetch_articles.config_session).
+
+    and creates a list of DOU articles' URLs to download. An already opened
+    `registry` of captured URLs (see url_registry) can be given to avoid 
+    loading 'url_list' again.
     """
     
-    # Hard-coded stuff:
-    url_prefix = 'http://www.in.gov.br/web/dou/-/'
-    
     # Debug message:
     if True or gs.debug:
         print("Starting get_articles_url with config:")
@@ -329,37 +397,45 @@ def get_articles_url(config):
     secoes = secoes if type(secoes) == list else [secoes]
     secoes = [str(s) for s in secoes]
     
-    # LOOP over dates:
-    url_file_list = []
+    # List all dates and sections to look for articles:
     start_date = end_date + timedelta
+    date_secao = [(date, s) for date in daterange(start_date, end_date + dt.timedelta(days=1)) for s in secoes]
+    
+    # Forget about index snapshots of captures that crashed:
+    if config.get('index_diff', False):
+        if config.get('index_cache_path') is None:
+            raise Exception('index_diff requires index_cache_path to be set.')
+        ic.clear_pending_snapshots(config['index_cache_path'])
+
+    # Download the lists of articles (in parallel, over a single pool of connections):
+    concurrency = config.get('index_concurrency', 1)
+    session     = ft.config_session(config, concurrency)
     if gs.debug:
-        print('Will enter loop over config date and section range:')    
-    for date in daterange(start_date, end_date + dt.timedelta(days=1)):
+        print('Will download the article lists for config date and section range:')
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        # PS: map returns the results in the order of date_secao:
+        url_files_list = list(executor.map(lambda d_s: get_index_url_files(d_s[0], d_s[1], session, config), date_secao))
+
+    # LOOP over dates and DOU sections:
+    url_file_list = []
+    for (date, s), url_files in zip(date_secao, url_files_list):
         if gs.debug:
-            print('-- '+date.strftime('%Y-%m-%d'))
-        # LOOP over DOU sections:
-        for s in secoes:
-            if gs.debug:
-                print('   -- s'+str(s))
-            jsons = get_artigos_do(date, s)
-            # LOOP over downloaded URL list:
-            if gs.debug:
-                print('      Looping over URLs...')            
-            for j in jsons:
-                url      = url_prefix + j['urlTitle']
-                filename = build_filename(date, s, j['urlTitle'])
-                url_file_list.append({'url':url, 'filename':filename})
+            print('-- ' + date.strftime('%Y-%m-%d') + ' s' + str(s) + ': ' + str(len(url_files)) + ' articles')
+        url_file_list.extend(url_files)
 
     # Filter out already captured articles:
-    url_file_list = filter_captured_urls(url_file_list, config['url_list'])
+    url_file_list = filter_captured_urls(url_file_list, config['url_list'], registry)
     Nurls         = len(url_file_list)
     
     if gs.local == False:
         # Chop article list to fit into AWS time limit:
         batch_size    = config['article_batch_size']
+        if config.get('index_diff', False):
+            # Articles left out must be returned again in the next batch:
+            ic.drop_pending_articles(config['index_cache_path'], url_file_list[batch_size:])
         url_file_list = url_file_list[:batch_size]
             
-    return url_file_list, update_config(config, Nurls)
+    return url_file_list, update_config(config, Nurls, registry)
 
 
 def load_remote_config():
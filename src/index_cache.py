@@ -0,0 +1,239 @@
+import json
+import hashlib
+import datetime as dt
+import glob
+import os
+
+
+# Format used to record when an entry was fetched:
+fetched_format = '%Y-%m-%d %H:%M:%S'
+
+
+def cache_filename(cache_path, date, secao):
+    """
+    Return the path of the file in the directory `cache_path` (str) that
+    caches the DOU index page (leiturajornal) for the date `date` (datetime)
+    and section `secao` (str or int).
+    """
+    return os.path.join(cache_path, date.strftime('%Y-%m-%d') + '_s' + str(secao) + '.json')
+
+
+def load_entry(cache_path, date, secao):
+    """
+    Load the cache entry (a dict) for the index page of date `date`
+    (datetime) and section `secao` stored in the directory `cache_path`.
+    Return None if there is no such entry.
+    """
+    filename = cache_filename(cache_path, date, secao)
+    if os.path.isfile(filename) == False:
+        return None
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def save_entry(cache_path, date, secao, entry):
+    """
+    Save the cache `entry` (dict) for the index page of date `date`
+    (datetime) and section `secao` to the directory `cache_path`,
+    creating it if needed. The file is replaced atomically, so a crash
+    never leaves a half-written entry.
+    """
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path, exist_ok=True)
+
+    filename = cache_filename(cache_path, date, secao)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(entry, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def content_hash(content):
+    """
+    Return a hash (str) of the bytes `content` of an HTTP response body,
+    used to detect unchanged pages when the server does not answer
+    conditional requests.
+    """
+    return hashlib.sha1(content).hexdigest()
+
+
+def conditional_headers(entry):
+    """
+    Given a cache `entry` (dict or None), return the HTTP headers (dict)
+    for a conditional GET that only downloads the page if it changed.
+    """
+    headers = {}
+    if entry is None:
+        return headers
+    if entry.get('etag') != None:
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified') != None:
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def is_settled(entry, date, settle_days, now):
+    """
+    Return True if the cache `entry` (dict or None) for the index page
+    of date `date` (datetime) was fetched at least `settle_days` days
+    after that date, i.e. when the page should not change anymore.
+    `now` (datetime) is the current time, used to check that the
+    page's date is old enough.
+    """
+    if entry is None or entry.get('content_hash') is None:
+        return False
+    settle_date = date + dt.timedelta(days=settle_days)
+    fetched_at  = dt.datetime.strptime(entry['fetched_at'], fetched_format)
+    return now >= settle_date and fetched_at >= settle_date
+
+
+def new_entry(response, url_files, now):
+    """
+    Create a cache entry (dict) for the index page HTTP `response`,
+    storing its validators (ETag and Last-Modified), a hash of its
+    content, the time it was fetched `now` (datetime) and the list of
+    dicts `url_files` built from it.
+    """
+    return {'etag':          response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash':  content_hash(response.content),
+            'fetched_at':    now.strftime(fetched_format),
+            'url_files':     url_files}
+
+
+def refresh_entry(entry, response, now):
+    """
+    Update the cache `entry` (dict) after the index page HTTP `response`
+    showed that the page did not change: record the new fetch time `now`
+    (datetime) and any new validators.
+    """
+    entry = dict(entry)
+    if response.headers.get('ETag') != None:
+        entry['etag'] = response.headers.get('ETag')
+    if response.headers.get('Last-Modified') != None:
+        entry['last_modified'] = response.headers.get('Last-Modified')
+    entry['fetched_at'] = now.strftime(fetched_format)
+    return entry
+
+
+# Snapshots of the articles listed in index pages (used to find out
+# which articles are new since the last capture):
+
+def snapshot_filename(cache_path, date, secao, pending=False):
+    """
+    Return the path of the file in the directory `cache_path` (str) that
+    stores the snapshot of the index page for the date `date` (datetime)
+    and section `secao`. If `pending` is True, return the path of the 
+    snapshot that was not committed yet.
+    """
+    suffix = '.snapshot.pending.json' if pending else '.snapshot.json'
+    return os.path.join(cache_path, date.strftime('%Y-%m-%d') + '_s' + str(secao) + suffix)
+
+
+def load_snapshot(cache_path, date, secao, pending=False):
+    """
+    Load the (committed or `pending`) snapshot (dict) of the index page 
+    for date `date` (datetime) and section `secao` stored in the directory
+    `cache_path`. Return None if there is no such snapshot.
+    """
+    filename = snapshot_filename(cache_path, date, secao, pending)
+    if os.path.isfile(filename) == False:
+        return None
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def save_snapshot(cache_path, date, secao, snapshot, pending=False):
+    """
+    Save the (committed or `pending`) `snapshot` (dict) of the index page 
+    for date `date` (datetime) and section `secao` to the directory 
+    `cache_path`, replacing the file atomically.
+    """
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path, exist_ok=True)
+
+    filename = snapshot_filename(cache_path, date, secao, pending)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def entry_fingerprint(j):
+    """
+    Return a hash (str) of the json `j` (dict) that describes an article
+    in an index page, used to find out if its metadata changed.
+    """
+    return hashlib.sha1(json.dumps(j, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def new_snapshot(response, jsons, now):
+    """
+    Create a snapshot (dict) of the index page HTTP `response`, storing 
+    its validators (see new_entry), the time it was fetched `now` 
+    (datetime) and the fingerprint of each article in `jsons` (the 
+    list of dicts in the page's jsonArray), keyed by its urlTitle.
+    """
+    return {'etag':          response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash':  content_hash(response.content),
+            'fetched_at':    now.strftime(fetched_format),
+            'articles':      {j['urlTitle']: entry_fingerprint(j) for j in jsons}}
+
+
+def diff_snapshots(old, new):
+    """
+    Compare the snapshots `old` (dict or None) and `new` (dict) of the 
+    same index page and return three lists of urlTitles: the articles 
+    that were added, that changed (e.g. corrections) and that were 
+    removed.
+    """
+    old_articles = {} if old is None else old['articles']
+    new_articles = new['articles']
+
+    added   = [t for t in new_articles if t not in old_articles]
+    changed = [t for t in new_articles if t in old_articles and new_articles[t] != old_articles[t]]
+    removed = [t for t in old_articles if t not in new_articles]
+    return added, changed, removed
+
+
+def drop_pending_articles(cache_path, url_files):
+    """
+    Remove the articles described by `url_files` (list of dicts with keys
+    'date', 'secao' and 'urlTitle') from the pending snapshots in 
+    `cache_path`, so they are reported as new again in the next capture.
+    The validators of the affected snapshots are erased, to force the 
+    index page to be parsed again.
+    """
+    # Group articles by index page:
+    by_page = {}
+    for url_file in url_files:
+        by_page.setdefault((url_file['date'], url_file['secao']), []).append(url_file['urlTitle'])
+
+    for (date, secao), titles in by_page.items():
+        date     = dt.datetime.strptime(date, '%Y-%m-%d')
+        snapshot = load_snapshot(cache_path, date, secao, pending=True)
+        if snapshot is None:
+            continue
+        for t in titles:
+            snapshot['articles'].pop(t, None)
+        snapshot['etag'] = snapshot['last_modified'] = snapshot['content_hash'] = None
+        save_snapshot(cache_path, date, secao, snapshot, pending=True)
+
+
+def clear_pending_snapshots(cache_path):
+    """
+    Delete the pending snapshots in `cache_path` (e.g. left behind
+    by a capture that crashed).
+    """
+    for pending in glob.glob(os.path.join(cache_path, '*.snapshot.pending.json')):
+        os.remove(pending)
+
+
+def commit_snapshots(cache_path):
+    """
+    Replace the snapshots in `cache_path` by the pending ones, i.e. 
+    mark all articles in the pending snapshots as processed.
+    """
+    for pending in glob.glob(os.path.join(cache_path, '*.snapshot.pending.json')):
+        os.replace(pending, pending.replace('.snapshot.pending.json', '.snapshot.json'))
@@ -0,0 +1,82 @@
+import re
+import unicodedata
+
+
+class KeywordMatcher:
+    """
+    Finds, in a single pass over a text, which of a fixed set of keywords
+    appear in it as substrings (i.e. the keywords `k` for which `k in text`
+    is True). The keywords are compiled into one regular expression shaped
+    as their prefix tree, so at each position of the text only the
+    branches that match the next characters are followed.
+
+    Matching is exact (case-sensitive): lowercase both the keywords and
+    the text to reproduce the filters' `var.lower() in text.lower()`, or
+    normalize both (see normalize) to ignore case and accents.
+    """
+
+    def __init__(self, keywords):
+        """
+        Compile the matcher for the list of strings `keywords`.
+        """
+        self.keywords = set(keywords)
+        # The empty keyword is found in any text:
+        self.always   = {''} & self.keywords
+        words = sorted(self.keywords - self.always)
+
+        # At each position, the regex returns the longest keyword that starts there.
+        # The shorter keywords starting there are prefixes of it:
+        self.prefixes = {w: {p for p in words if w.startswith(p)} for w in words}
+        self.pattern  = re.compile('(?=(' + trie_regex(words) + '))') if len(words) > 0 else None
+
+    def find(self, text):
+        """
+        Return the set of keywords found in the string `text`.
+        """
+        found = set(self.always)
+        if self.pattern != None:
+            prefixes = self.prefixes
+            for m in self.pattern.finditer(text):
+                found.update(prefixes[m.group(1)])
+        return found
+
+    def __len__(self):
+        return len(self.keywords)
+
+
+def trie_regex(words):
+    """
+    Return a regular expression (str) that matches any of the non-empty
+    strings in `words` (list), built from their prefix tree, preferring
+    the longest match.
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for c in w:
+            node = node.setdefault(c, {})
+        node[''] = True
+
+    def node_regex(node):
+        branches = [re.escape(c) + node_regex(child) for c, child in sorted(node.items()) if c != '']
+        if len(branches) == 0:
+            return ''
+        regex = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Words may end at this node, so the continuation is optional (greedy, so longer words first):
+        return '(?:' + regex + ')?' if '' in node else regex
+
+    return node_regex(trie)
+
+
+# Combining diacritical marks (accents, cedilla, tilde etc.) left apart from their letters by
+# the NFKD decomposition:
+diacritical_marks = re.compile('[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]+')
+
+
+def normalize(text):
+    """
+    Return the string `text` without case and accents (e.g. 'Educação'
+    and 'EDUCACAO' both become 'educacao'), for matching keywords
+    regardless of their spelling.
+    """
+    return diacritical_marks.sub('', unicodedata.normalize('NFKD', text.casefold()))
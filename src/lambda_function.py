@@ -55,7 +55,8 @@ def local_scheduler(config):
                         (a negative number);
     * filter_file:      JSON filename that describes the filters to be applied to articles;
     * post_articles:    BOOL that tells whether or not to post articles to Slack;
-    * slack_token:      filename for file containing Slack's authentication token.    
+    * slack_token:      filename for file containing Slack's authentication token;
+    * fetch_concurrency: number of articles downloaded simultaneously (optional, default 1).
     """
     while True:
         print(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()))
@@ -23,7 +23,8 @@ The configuration has the keywords:
                     (a negative number);
 * filter_file:      JSON filename that describes the filters to be applied to articles;
 * post_articles:    BOOL that tells whether or not to post articles to Slack;
-* slack_token:      filename for file containing Slack's authentication token.
+* slack_token:      filename for file containing Slack's authentication token;
+* fetch_concurrency: number of articles downloaded simultaneously (optional, default 1).
 
 Written by Henrique S. Xavier, hsxavier@gmail.com, on 25/jun/2019.
 """
@@ -0,0 +1,118 @@
+import json
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+import os
+import parse_dou_article as pa
+
+
+class ParseCache:
+    """
+    Cache of parsed and structured DOU articles keyed by a hash of the 
+    article page's html and of the parser version 
+    (parse_dou_article.PARSER_VERSION), so a page seen again (e.g. in 
+    reruns and backfills) is neither parsed nor structured again.
+
+    Up to `max_size` articles are kept in memory, evicting the least
+    recently used. If `path` (str) is given, the articles are also
+    stored in that directory (one JSON file each) and read from there
+    when they are not in memory. Lookup statistics are available from
+    `stats`.
+    """
+
+    def __init__(self, max_size=1000, path=None):
+        self.max_size = max_size
+        self.path     = path
+        self.entries  = OrderedDict()
+        self.counts   = {'lookups': 0, 'hits': 0, 'disk_hits': 0}
+
+    def key(self, text):
+        """
+        Return the cache key (str) of the article page's html `text` (str).
+        """
+        content = (str(pa.PARSER_VERSION) + '\n' + text).encode('utf-8', errors='surrogatepass')
+        return hashlib.sha1(content).hexdigest()
+
+    def filename(self, key):
+        """
+        Return the path of the file that stores the article with `key` (str).
+        """
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def remember(self, key, entry):
+        """
+        Keep the cache `entry` (dict) in memory, evicting the least
+        recently used one if the cache is full.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, key, url):
+        """
+        Return the tuple (raw_article, article) for the cached article
+        with `key` (str), as if it was parsed from `url` (str) now (see
+        parse_pool.parse_and_structure), or None if it is not cached.
+        Only the URL and the capture date are changed in the cached
+        structured article (a copy of it is returned).
+        """
+        self.counts['lookups'] = self.counts['lookups'] + 1
+
+        entry = self.entries.get(key)
+        if entry != None:
+            self.entries.move_to_end(key)
+            self.counts['hits'] = self.counts['hits'] + 1
+        elif self.path != None and os.path.isfile(self.filename(key)):
+            with open(self.filename(key), 'r') as f:
+                entry = json.load(f)
+            # Files written before the structured articles were cached:
+            if 'article' not in entry:
+                return None
+            self.remember(key, entry)
+            self.counts['disk_hits'] = self.counts['disk_hits'] + 1
+        else:
+            return None
+
+        capture_date = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        raw_article  = pa.RawArticle(dict(entry['fields']), url, capture_date, entry['url_certificado'])
+        article      = dict(entry['article'], url=url, capture_date=capture_date)
+        return raw_article, article
+
+    def put(self, key, raw_article, article):
+        """
+        Store the `raw_article` (RawArticle) parsed from the html with
+        `key` (str) and its structured version `article` (dict, see 
+        structure_article) in the cache.
+        """
+        entry = {'fields': raw_article.fields, 'url_certificado': raw_article.url_certificado, 'article': dict(article)}
+        self.remember(key, entry)
+
+        if self.path != None:
+            filename = self.filename(key)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(entry, f)
+            os.replace(filename + '.tmp', filename)
+
+    def stats(self):
+        """
+        Return a dict with the number of lookups, of hits in memory and on
+        disk, and the hit rate.
+        """
+        stats = dict(self.counts)
+        hits  = stats['hits'] + stats['disk_hits']
+        stats['hit_rate'] = round(hits / stats['lookups'], 6) if stats['lookups'] > 0 else 0.0
+        return stats
+
+
+def open_config_cache(config):
+    """
+    Return the ParseCache described by the configuration `config` (dict)
+    keywords parse_cache_size (number of articles kept in memory) and
+    parse_cache_path (directory for the on-disk cache, optional), or None
+    if parse_cache_size is not set.
+    """
+    if config.get('parse_cache_size') is None:
+        return None
+    return ParseCache(config['parse_cache_size'], config.get('parse_cache_path'))
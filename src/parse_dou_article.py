@@ -1,9 +1,31 @@
 from lxml import html
+from lxml import etree
 from datetime import datetime
 from collections import defaultdict
 import re
 
 
+# Version of the parser's output (change it whenever the output of parse_dou_text
+# or of structure_article.structure_article changes, to invalidate cached articles, 
+# see parse_cache.py):
+PARSER_VERSION = 1
+
+# Values without letters or numbers are dropped (see filter_values):
+letter_or_number = re.compile('[a-zA-Z0-9]')
+
+# Compiled selectors (so they are compiled once per process):
+# Article element (by the id index of the parsed document, with a search as fallback):
+materia_by_id     = etree.XPath('id("materia")')
+materia_search    = etree.XPath('//*[@id="materia"]')
+# Link to the certified version (in the article or, as fallback, in the whole document):
+certificado_local = etree.XPath('descendant::*[@class="botao-materia"]/a[@href]/@href', smart_strings=False)
+certificado_doc   = etree.XPath('//*[@class="botao-materia"]/a[@href]/@href', smart_strings=False)
+# Text nodes of an element (in document order) and attribute values of
+# an element and its descendants:
+text_nodes        = etree.XPath('descendant::text()', smart_strings=False)
+attribute_values  = etree.XPath('descendant-or-self::*/@*', smart_strings=False)
+
+
 def select_article(response):
     """
     Transforms html into lxml data type and selects only 
@@ -13,9 +35,98 @@ def select_article(response):
         response: requests.models.Response
     return: lxml.html.HtmlElement
     """
-    tree  = html.fromstring(response.text) # Changed from .content to .text to avoid decoding errors later on (2020-04-15)
-    xpath = '//*[@id="materia"]'
-    return tree.xpath(xpath)[0]
+    return select_article_text(response.text) # Changed from .content to .text to avoid decoding errors later on (2020-04-15)
+
+
+def select_article_text(text):
+    """
+    Same as select_article, but takes the article's html as a string.
+    
+    input: 
+        text: string
+    return: lxml.html.HtmlElement
+    """
+    tree    = html.fromstring(text)
+    article = materia_by_id(tree)
+    if len(article) == 0:
+        article = materia_search(tree)
+    return article[0]
+
+
+def release_response(response, drain_size=65536):
+    """
+    Finish the `response` (requested with stream=True) whose body was 
+    partially read: if at most `drain_size` bytes (int) of the body are 
+    left, they are read and discarded and the connection goes back to the
+    session's pool (keep-alive); otherwise the connection is closed, 
+    without downloading the rest.
+    """
+    raw = response.raw
+    if raw is None or not hasattr(raw, 'release_conn'):
+        response.close()
+        return
+    try:
+        drained = 0
+        while drained <= drain_size:
+            chunk = raw.read(16384, decode_content=False)
+            if len(chunk) == 0:
+                raw.release_conn()
+                return
+            drained = drained + len(chunk)
+    except Exception:
+        pass
+    response.close()
+
+
+def select_article_stream(response, chunk_size=16384):
+    """
+    Same as select_article, but reads the response body (requested with 
+    stream=True) in chunks of `chunk_size` bytes, feeding an incremental 
+    parser, and stops reading as soon as the article div, its tail and 
+    the link to the certified version (see get_url_certificado) were 
+    parsed. The rest of the page is not parsed and, unless it is small
+    (see release_response), not downloaded.
+
+    If the response has no declared encoding, the whole body is read
+    (see select_article).
+    
+    input: 
+        response: requests.models.Response
+        chunk_size: int
+    return: lxml.html.HtmlElement
+    """
+    if response.encoding is None:
+        return select_article(response)
+    
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding=response.encoding)
+    parser.set_element_class_lookup(html.HtmlElementClassLookup())
+    
+    article     = None
+    closed      = False    # The article's end tag was parsed.
+    tail_done   = False    # Something after the article's tail was parsed.
+    certificado = False    # The link to the certified version was parsed.
+    for chunk in response.iter_content(chunk_size):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if closed:
+                tail_done = True
+            if article is None:
+                # First element with the article's id (as in materia_by_id):
+                if event == 'start' and element.get('id') == 'materia':
+                    article = element
+            elif event == 'end' and element is article:
+                closed      = True
+                certificado = certificado or len(certificado_local(article)) > 0
+            if not certificado and event == 'end' and element.get('class') == 'botao-materia':
+                certificado = element.find('a[@href]') is not None
+        if closed and tail_done and certificado:
+            break
+    root = parser.close()
+    release_response(response)
+
+    if article is None:
+        return materia_search(root)[0]
+    return article
 
 
 def branch_text(branch):
@@ -132,9 +243,12 @@ def filter_values(data):
     return final
 
 
-def decoded_full_text(article):
+def serialized_full_text(article):
     """
-    Get articles' full text (without identifying html tags).
+    Get articles' full text (without identifying html tags) by 
+    serializing the html and removing the tags with regex. This is 
+    the original (slow) method, used by decoded_full_text when the
+    html has something that the regex handles in a special way.
     """
     try:
         full_text = html.tostring(article, method='html', encoding='utf-8').decode('utf-8')
@@ -157,13 +271,156 @@ def decoded_full_text(article):
     return full_text
 
 
+def streamed_full_text(article):
+    """
+    Get articles' full text (without identifying html tags) directly 
+    from the tree's text nodes, with the same result as 
+    serialized_full_text: '&', '<' and '>' are kept escaped, comments
+    are removed, the article's tail is included and the whitespace is
+    normalized. Return None if the article has nodes that the regex in
+    serialized_full_text does not remove cleanly (script and style 
+    elements, comments with '>' or line breaks, attributes with line 
+    breaks).
+    """
+    # Look for nodes not handled here:
+    for node in article.iter(etree.Comment, etree.ProcessingInstruction, 'script', 'style'):
+        if node.tag in ('script', 'style') or node.tag is etree.ProcessingInstruction:
+            return None
+        if '>' in node.text or '\n' in node.text:
+            return None
+    if '\n' in ''.join(attribute_values(article)):
+        return None
+    
+    texts = text_nodes(article)
+    if article.tail != None:
+        texts.append(article.tail)
+    full_text = ' '.join(texts)
+    full_text = full_text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return ' '.join(full_text.split())
+
+
+def decoded_full_text(article):
+    """
+    Get articles' full text (without identifying html tags).
+    """
+    try:
+        full_text = streamed_full_text(article)
+    except:
+        full_text = None
+    if full_text is None:
+        full_text = serialized_full_text(article)
+    return full_text
+
+
+def join_fragments(fragments):
+    """
+    Join the texts (str or None) in the list `fragments`, found in the 
+    nodes that share a key, as successive calls to add_to_data would: 
+    leading None are skipped and later ones become 'None'. Return None
+    if all fragments are None.
+    """
+    parts = []
+    for fragment in fragments:
+        if len(parts) > 0:
+            parts.append('None' if fragment is None else fragment)
+        elif fragment is not None:
+            parts.append(fragment)
+    if len(parts) == 0:
+        return None
+    return ' | '.join(parts)
+
+
+def extract_fields(article):
+    """
+    Single pass version of recurse_over_nodes followed by filter_keys:
+    walk over the html tree 'article' iteratively, gather the text of 
+    each node (see branch_text) into a list per key and join each list
+    only once, so the time is linear in the size of the article.
+
+    input: 
+        article: lxml.html.HtmlElement
+    return: dict
+    """
+    # Text fragments of each key path, in order of first appearance:
+    fragments = {}
+    # Last class of each key path (used as final key):
+    last_keys = {}
+    # Key paths already built from (parent key path, node's key):
+    paths     = {}
+
+    stack = [(iter(article), None)]
+    while len(stack) > 0:
+        branch = next(stack[-1][0], None)
+        if branch is None:
+            stack.pop()
+            continue
+        parent_key = stack[-1][1]
+        
+        own_key = '-'.join(branch.classes)
+        key     = paths.get((parent_key, own_key))
+        if key is None:
+            key = '%s_%s' % (parent_key, own_key) if parent_key else own_key
+            paths[(parent_key, own_key)] = key
+        
+        if key in fragments:
+            fragments[key].append(branch_text(branch))
+        else:
+            fragments[key] = [branch_text(branch)]
+            last_keys[key] = key.split('_')[-1]
+        
+        if len(branch) > 0:
+            stack.append((iter(branch), key))
+
+    # Group key paths by their last class (as filter_keys does):
+    grouped = {}
+    for key, texts in fragments.items():
+        text = join_fragments(texts)
+        if text is not None:
+            new_key = last_keys[key]
+            if new_key in grouped:
+                grouped[new_key].append(text)
+            else:
+                grouped[new_key] = [text]
+    
+    final = {}
+    for new_key, texts in grouped.items():
+        # Leading empty texts are skipped:
+        i = 0
+        while i < len(texts) - 1 and len(texts[i]) == 0:
+            i = i + 1
+        final[new_key] = ' | '.join(texts[i:])
+    
+    return final
+
+
 def get_data(article):
     """
-    Get relevant data from html. It recursevely gets leaf text from html
-    and saves theirs classes as keys. 
+    Get relevant data from html. It gets leaf text from html (in a 
+    single pass, see extract_fields) and saves theirs classes as keys. 
     It also creates an item in dict's key 'full-text' with all text 
     in the html, without tags.
     
+    input: 
+        article: lxml.html.HtmlElement
+    return: dict
+    """
+    data = extract_fields(article)
+
+    # filtra valores sem letras ou números e chaves vazias:
+    data = {k: v for k,v in data.items() if len(k) != 0 and letter_or_number.search(v)}
+
+    # Include full-text:
+    data['fulltext'] = decoded_full_text(article)
+    
+    return data
+
+
+def get_data_legacy(article):
+    """
+    Same as get_data, but using the original recursive extraction
+    (recurse_over_nodes, filter_keys and filter_values) and full text 
+    (serialized_full_text). Kept for comparison (see benchmark_dou.py).
+    
     input: 
         article: lxml.html.HtmlElement
     return: dict
@@ -179,23 +436,27 @@ def get_data(article):
     #data = decode(data)
     
     # Include full-text:
-    data['fulltext'] = decoded_full_text(article)
+    data['fulltext'] = serialized_full_text(article)
     
     return data
 
 
 def get_url_certificado(article):
     """
-    Gets in certified url in the html
+    Gets in certified url in the html, looking first inside the 
+    article and then in the whole document.
     
     input: 
         artigo: lxml.html.HtmlElement
     return: string
     """
-    return article.xpath('//*[@class="botao-materia"]/a[@href]/@href')[0]
+    hrefs = certificado_local(article)
+    if len(hrefs) == 0:
+        hrefs = certificado_doc(article)
+    return hrefs[0]
 
 
-def data_schema(key, value, url, url_certificado):
+def data_schema(key, value, url, url_certificado, capture_date=None):
     """
     Final data schema
     
@@ -204,22 +465,62 @@ def data_schema(key, value, url, url_certificado):
         value: string
         url: string
         url_certificado: string
+        capture_date: string (default: now)
     return: dict
     """    
+    if capture_date is None:
+        capture_date = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
     return {
         "key": key,
         "value": value,
         "url": url,
-        "capture_date": datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S'),
+        "capture_date": capture_date,
         "url_certificado": url_certificado
     }
 
 
+class RawArticle:
+    """
+    A parsed DOU article: the value (text) of each field (an html tag 
+    class), in a dict keyed by field, and the url, capture date and 
+    certified url, stored once for the whole article. 
+    
+    Each field's value is read with `get` and the list of dicts (one 
+    per field, see data_schema) written to the database is built by 
+    `rows`.
+    """
+    __slots__ = ('fields', 'url', 'capture_date', 'url_certificado')
+
+    def __init__(self, fields, url, capture_date, url_certificado):
+        self.fields          = fields
+        self.url             = url
+        self.capture_date    = capture_date
+        self.url_certificado = url_certificado
+
+    def get(self, key):
+        """
+        Return the value of the field `key` (str), or None if the article 
+        does not have it.
+        """
+        return self.fields.get(key)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def rows(self):
+        """
+        Return the article as a list of dicts, one per field, with keys 
+        key, value, url, capture_date and url_certificado.
+        """
+        return [data_schema(key, value, self.url, self.url_certificado, self.capture_date) 
+                for key, value in self.fields.items()]
+
+
 def structure_data(data, url, article):
     """
-    Structures html parsed data to list of dicts 
-    ready to be processed by http-request Lambda
-    Function.
+    Structures html parsed data to a RawArticle 
+    (whose rows are ready to be processed by 
+    http-request Lambda Function).
     It adds the capture date, url, and 
     certified url
     
@@ -227,29 +528,47 @@ def structure_data(data, url, article):
         data: dict
         url: string
         artigo: lxml.html.HtmlElement
-    return: list of dict
+    return: RawArticle
     """    
     url_certificado = get_url_certificado(article)
-    
-    final = []
-    for key, value in data.items():        
-        final.append(data_schema(key, value, url, url_certificado))
+    capture_date    = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
         
-    return final
+    return RawArticle(data, url, capture_date, url_certificado)
         
 
 def parse_dou_article(response, url):
     """
     Gets an HTTP request response for a DOU article's URL and that url 
-    and parse the relevant fields to a list of dicts. Each dict has the 
-    keys: 
+    and parse the relevant fields to a RawArticle, whose rows are dicts 
+    with the keys: 
     * key             -- an html tag class identifying the field;
     * value           -- the respective value (text) in that field;
     * url             -- The original article URL;
     * capture_date    -- The date when capture occured;
     * url_certificado -- The link to the certified version of the article.
     """
-    article = select_article(response)    
+    return parse_dou_text(response.text, url)
+
+
+def parse_dou_text(text, url):
+    """
+    Same as parse_dou_article, but takes the article's html as a string
+    (e.g. a body stored in the article archive, see article_archive.py).
+    """
+    article = select_article_text(text)    
+    data    = get_data(article)    
+    data    = structure_data(data, url, article)
+    
+    return data
+
+
+def parse_dou_stream(response, url):
+    """
+    Same as parse_dou_article, but only reads and parses the response
+    (requested with stream=True) up to the article (see 
+    select_article_stream).
+    """
+    article = select_article_stream(response)    
     data    = get_data(article)    
     data    = structure_data(data, url, article)
     
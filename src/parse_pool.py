@@ -0,0 +1,162 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+import multiprocessing
+import requests
+import parse_dou_article as pa
+import structure_article as sa
+
+
+def parse_and_structure(source, url):
+    """
+    Parse the DOU article found at `url` (str) and select its relevant 
+    fields. `source` is either the article's html (str) or its response
+    requested with stream=True, which is only read up to the article 
+    (see parse_dou_article.parse_dou_stream). Return a tuple 
+    (raw_article, article) with the outputs of parse_dou_article and 
+    structure_article, or None if reading the streamed response crashed 
+    (a warning is printed in this case).
+    """
+    if type(source) == str:
+        raw_article = pa.parse_dou_text(source, url)
+    else:
+        try:
+            raw_article = pa.parse_dou_stream(source, url)
+        except requests.exceptions.RequestException:
+            print('Error reading body of GET ' + url)
+            return None
+    article = sa.structure_article(raw_article)
+    return raw_article, article
+
+
+def fetched_bodies(fetched, stream=False):
+    """
+    Generator that takes the tuples (url_file, response) yielded by
+    fetch_articles.fetch_articles and yields the tuples (key, source, url)
+    taken by parse_stream, where key is (url_file, response) and source
+    is the response's text (or the response itself, if `stream` is True) 
+    or None if the GET crashed or returned a bad status.
+    """
+    for url_file, response in fetched:
+        if response != None and response.status_code == 200:
+            yield (url_file, response), response if stream else response.text, url_file['url']
+        else:
+            yield (url_file, response), None, url_file['url']
+
+
+def parse_stream(items, processes=0, cache=None):
+    """
+    Generator that parses and structures (see parse_and_structure) the
+    articles in `items`, an iterable of tuples (key, source, url), and
+    yields tuples (key, parsed) in the same order as the input, where
+    `parsed` is the tuple (raw_article, article) or None if `source` is
+    None.
+
+    If `processes` > 1, the articles are parsed by a pool of that many
+    processes while the input (e.g. the GETs) keeps running in this one
+    (in this case, `source` must be a str).
+    Only a window of 2 x `processes` articles is kept ahead of the
+    consumer, so parsed articles do not pile up in memory.
+
+    If a `cache` (see parse_cache.ParseCache) is given, articles whose
+    html (str sources only) is in it are not parsed again.
+    """
+
+    # Serial mode (parse in this process):
+    if processes <= 1:
+        for key, source, url in items:
+            if source is None:
+                yield key, None
+            elif cache is None or type(source) != str:
+                yield key, parse_and_structure(source, url)
+            else:
+                yield key, cached_parse(cache, source, url)
+        return
+
+    # Process pool mode:
+    # PS: the workers are forked (the scripts cannot be imported by spawned processes) 
+    # and are all started before `items` is consumed (e.g. before the GETs' threads are started):
+    window = 2 * processes
+    global start_barrier
+    start_barrier = multiprocessing.get_context('fork').Barrier(processes)
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork')) as executor:
+        start_workers(executor, processes)
+        pending = deque()
+        for key, source, url in items:
+            pending.append(submit_parse(executor, cache, key, source, url))
+            if len(pending) >= window:
+                yield collect_parse(cache, pending.popleft())
+        while len(pending) > 0:
+            yield collect_parse(cache, pending.popleft())
+
+
+# Barrier on which the process pool's workers wait when they are started (see start_workers):
+start_barrier = None
+
+
+def wait_start():
+    """
+    Wait until all workers of the process pool run this function.
+    """
+    start_barrier.wait(60)
+
+
+def start_workers(executor, processes):
+    """
+    Start all `processes` (int) workers of the process pool `executor` and
+    wait for them. Each worker gets a task that only ends when all of them 
+    are running, so a pool that starts its workers on demand (as in 
+    Python 3.9 and 3.10) has to start a new one for each task. The 
+    workers inherit `start_barrier`, which must be set before the pool is 
+    created.
+    """
+    futures = [executor.submit(wait_start) for i in range(processes)]
+    for future in futures:
+        future.result()
+
+
+def cached_parse(cache, text, url):
+    """
+    Return parse_and_structure(text, url), taking it from the `cache`
+    (see parse_cache.ParseCache) if possible and storing it otherwise.
+    """
+    cache_key = cache.key(text)
+    parsed    = cache.get(cache_key, url)
+    if parsed is None:
+        parsed = parse_and_structure(text, url)
+        cache.put(cache_key, parsed[0], parsed[1])
+    return parsed
+
+
+def submit_parse(executor, cache, key, source, url):
+    """
+    Submit the parsing of `source` found at `url` to the process pool
+    `executor`, unless `source` is None or the article is in the `cache`.
+    Return a tuple (key, future, cache_key) for collect_parse.
+    """
+    if source is None:
+        return key, None, None
+    if cache is None:
+        return key, executor.submit(parse_and_structure, source, url), None
+    
+    cache_key = cache.key(source)
+    parsed    = cache.get(cache_key, url)
+    if parsed is None:
+        return key, executor.submit(parse_and_structure, source, url), cache_key
+    # Already parsed:
+    future = Future()
+    future.set_result(parsed)
+    return key, future, None
+
+
+def collect_parse(cache, submitted):
+    """
+    Wait for the parsing `submitted` by submit_parse and return the tuple 
+    (key, parsed), storing newly parsed articles in the `cache`.
+    """
+    key, future, cache_key = submitted
+    if future is None:
+        return key, None
+    parsed = future.result()
+    if cache_key != None:
+        cache.put(cache_key, parsed[0], parsed[1])
+    return key, parsed
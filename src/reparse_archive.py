@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Parse, structure and filter again the DOU articles stored in the archive
+(the raw HTML saved during captures with 'archive_path' set in the
+configuration), without downloading them from in.gov.br. The articles 
+are saved according to the configuration file (see capture_dou.py), as 
+in a capture, but the selected articles are only posted if the 
+configuration has 'reparse_post_articles' set to true.
+
+USAGE:   reparse_archive.py <CONFIG_FILE> [START_DATE END_DATE]
+EXAMPLE: reparse_archive.py ../configs/capture_DOU_test.json 2020-01-01 2020-01-31
+
+START_DATE and END_DATE (format %Y-%m-%d) limit the reparse to the 
+articles published in that period (inclusive).
+"""
+
+import sys
+import capture_driver as cd
+
+# Docstring output:
+if len(sys.argv) != 1 + 1 and len(sys.argv) != 1 + 3:
+    print(__doc__)
+    sys.exit(0)
+
+# Get input:
+config_file = sys.argv[1]
+start_date  = sys.argv[2] if len(sys.argv) > 2 else None
+end_date    = sys.argv[3] if len(sys.argv) > 3 else None
+
+# Call driver of the archive's reparse:
+cd.reparse_archive_driver(config_file, start_date, end_date)
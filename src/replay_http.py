@@ -0,0 +1,163 @@
+import json
+import hashlib
+import random
+import threading
+import time
+import os
+import http
+import requests
+
+
+def response_filename(replay_path, url):
+    """
+    Return the path (without extension) of the files in the directory
+    `replay_path` (str) that store the recorded response for `url` (str).
+    """
+    return os.path.join(replay_path, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+def save_response(replay_path, url, status_code, headers, content):
+    """
+    Record a response for `url` (str) in the directory `replay_path`, with
+    HTTP `status_code` (int), `headers` (dict) and body `content` (bytes).
+    The files are replaced atomically.
+    """
+    os.makedirs(replay_path, exist_ok=True)
+    filename = response_filename(replay_path, url)
+    with open(filename + '.body.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(filename + '.body.tmp', filename + '.body')
+    with open(filename + '.json.tmp', 'w') as f:
+        json.dump({'url': url, 'status_code': status_code, 'headers': dict(headers)}, f)
+    os.replace(filename + '.json.tmp', filename + '.json')
+
+
+def load_response(replay_path, url):
+    """
+    Return a tuple (meta, content) with the recorded response for `url`
+    (str) in the directory `replay_path`, where `meta` is a dict with keys
+    'url', 'status_code' and 'headers' and `content` is the body (bytes).
+    Return (None, None) if no response was recorded for `url`.
+    """
+    filename = response_filename(replay_path, url)
+    if os.path.isfile(filename + '.json') == False:
+        return None, None
+    with open(filename + '.json', 'r') as f:
+        meta = json.load(f)
+    with open(filename + '.body', 'rb') as f:
+        content = f.read()
+    return meta, content
+
+
+def record_hook(replay_path):
+    """
+    Return a requests response hook that records every response (except
+    304 Not Modified, which has no body) in the directory `replay_path`,
+    to be replayed later by ReplayAdapter.
+    """
+    def record(response, *args, **kwargs):
+        if response.status_code != 304:
+            # Remove headers that do not apply to the stored (decoded) body:
+            headers = {k: v for k, v in response.headers.items()
+                       if k.lower() not in ('content-encoding', 'transfer-encoding', 'content-length')}
+            save_response(replay_path, response.url, response.status_code, headers, response.content)
+        return response
+    return record
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    """
+    requests transport adapter that answers GETs with the responses
+    recorded in a local directory (see record_hook), without accessing
+    the network. URLs with no recorded response get a 404.
+
+    Each request waits `latency` seconds (randomly between 0.5 and 1.5
+    times that value) and fails with a ConnectionError with probability
+    `error_rate`, being retried up to `max_retries` times (as the
+    HTTPAdapter does). Waits longer than the request's read timeout
+    raise a ReadTimeout instead. The random draws come from a generator
+    seeded with `seed`, for repeatable runs.
+    """
+
+    def __init__(self, replay_path, latency=0, error_rate=0, max_retries=3, seed=0):
+        super().__init__()
+        self.replay_path = replay_path
+        self.latency     = latency
+        self.error_rate  = error_rate
+        self.max_retries = max_retries
+        self.rng         = random.Random(seed)
+        self.lock        = threading.Lock()
+        self.stats       = {'requests': 0, 'errors': 0, 'retries': 0, 'not_found': 0}
+
+    def draw(self):
+        """
+        Return a tuple (delay, fail) for one attempt: the time to wait
+        (float, in seconds) and whether the attempt fails (bool).
+        """
+        with self.lock:
+            delay = self.latency * self.rng.uniform(0.5, 1.5)
+            fail  = self.rng.random() < self.error_rate
+        return delay, fail
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats[key] + 1
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.count('requests')
+        read_timeout = timeout[1] if type(timeout) == tuple else timeout
+
+        # Emulate the network:
+        for attempt in range(self.max_retries + 1):
+            delay, fail = self.draw()
+            if read_timeout != None and delay > read_timeout:
+                time.sleep(read_timeout)
+                self.count('errors')
+                raise requests.exceptions.ReadTimeout('Replay: read timed out.', request=request)
+            time.sleep(delay)
+            if not fail:
+                break
+            if attempt == self.max_retries:
+                self.count('errors')
+                raise requests.exceptions.ConnectionError('Replay: injected connection error.', request=request)
+            self.count('retries')
+
+        return self.build_response(request)
+
+    def build_response(self, request):
+        """
+        Return the recorded response (requests.Response) for the prepared
+        `request`, answering conditional GETs with 304 when the recorded
+        validators match.
+        """
+        meta, content = load_response(self.replay_path, request.url)
+        response = requests.models.Response()
+        response.url     = request.url
+        response.request = request
+        response.connection = self
+
+        if meta is None:
+            self.count('not_found')
+            response.status_code = 404
+            response._content    = b''
+        else:
+            response.status_code = meta['status_code']
+            response.headers     = requests.structures.CaseInsensitiveDict(meta['headers'])
+            response._content    = content
+            etag     = response.headers.get('ETag')
+            modified = response.headers.get('Last-Modified')
+            if ((etag != None and request.headers.get('If-None-Match') == etag) or
+                (modified != None and request.headers.get('If-Modified-Since') == modified)):
+                response.status_code = 304
+                response._content    = b''
+
+        try:
+            response.reason = http.HTTPStatus(response.status_code).phrase
+        except ValueError:
+            response.reason = ''
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Evaluate a filter file over the DOU articles saved locally (the files 
+written to 'storage_path' in captures with save_articles set to true), 
+without capturing them again. The articles are looked up in an index 
+(see article_index.py) kept in 'article_index_path' (default: 
+article_index.sqlite inside storage_path), which is first brought up to 
+date with the articles saved in the period. The selected articles are
+printed, by filter set; nothing is posted.
+
+USAGE:   search_archive.py <CONFIG_FILE> <FILTER_FILE> [START_DATE END_DATE]
+EXAMPLE: search_archive.py ../configs/capture_DOU_test.json ../filters/all_DOU_filters_2020-04-27.json 2020-01-01 2020-01-31
+
+START_DATE and END_DATE (format %Y-%m-%d) limit the search to the 
+articles published in that period (inclusive).
+"""
+
+import sys
+import time
+import get_articles_url as gu
+import filter_articles as fa
+import article_index as ai
+
+# Docstring output:
+if len(sys.argv) != 1 + 2 and len(sys.argv) != 1 + 4:
+    print(__doc__)
+    sys.exit(0)
+
+# Get input:
+config_file = sys.argv[1]
+filter_file = sys.argv[2]
+start_date  = sys.argv[3] if len(sys.argv) > 3 else None
+end_date    = sys.argv[4] if len(sys.argv) > 4 else None
+
+config    = gu.load_local_config(config_file)
+bot_infos = fa.format_filters(fa.load_local_filters(filter_file))
+
+# Update the index:
+t0     = time.time()
+conn   = ai.open_config_index(config)
+counts = ai.update_index(conn, config['storage_path'], start_date, end_date)
+print('Index updated in {:.2f}s:'.format(time.time() - t0), counts)
+
+# Evaluate the filters:
+t0      = time.time()
+results = ai.evaluate_filters(conn, bot_infos, start_date, end_date)
+conn.close()
+print('Filters evaluated in {:.2f}s'.format(time.time() - t0))
+
+for bot_info, result in zip(bot_infos, results):
+    print('\n# ' + str(bot_info['nome']) + ' (' + str(bot_info['media']['channel']) + '): ' + 
+          str(len(result['articles'])) + ' selected out of ' + str(result['candidates']) + ' candidates')
+    for article in result['articles']:
+        print(str(article['pub_date'] or article['capture_date']) + '  ' + str(article['identifica']) + '  ' + str(article['url']))
@@ -1,13 +1,10 @@
 def get_key_value(key, article_raw):
     """
-    Searches for an entry in article_raw (which is a list of dicts) that
-    has the 'key'. Then it returns the value associated to that key. 
-    If the key is not found, return None.
+    Returns the value associated to the 'key' in article_raw (a 
+    RawArticle, see parse_dou_article). If the key is not found, 
+    return None.
     """ 
-    sel = list(filter(lambda d: d['key']==key, article_raw))
-    if len(sel)==0:
-        return None
-    return sel[0]['value']
+    return article_raw.get(key)
 
 
 def make_resumo(fulltext):
@@ -48,10 +45,10 @@ def make_resumo(fulltext):
 
 def structure_article(article_raw):
     """
-    Takes a list of dicts that represent a DOU article with the keywords
-    key, value, capture_date, url and url_certificado and select relevant 
-    keys (hard-coded), rename them and output a dict with only the relevant 
-    keys.
+    Takes a RawArticle (see parse_dou_article) that represents a DOU 
+    article, whose rows have the keywords key, value, capture_date, url and 
+    url_certificado, and select relevant keys (hard-coded), rename them and
+    output a dict with only the relevant keys.
     """
     relevant_keys = ['secao-dou', 'orgao-dou-data', 'assina', 'identifica', 'cargo', 'secao-dou-data', 
                      'edicao-dou-data', 'dou-em', 'ementa', 'dou-strong', 'titulo', 'subtitulo', 
@@ -64,9 +61,9 @@ def structure_article(article_raw):
     struct = dict(zip(new_keys, relevant_values))
     
     # Join with identifying fields:
-    struct['capture_date']    = article_raw[0]['capture_date']
-    struct['url']             = article_raw[0]['url']
-    struct['url_certificado'] = article_raw[0]['url_certificado']
+    struct['capture_date']    = article_raw.capture_date
+    struct['url']             = article_raw.url
+    struct['url_certificado'] = article_raw.url_certificado
     
     # Format selected fields:
     struct['secao']  = struct['secao'].split('|')[0].split(':')[1].strip()
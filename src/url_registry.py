@@ -0,0 +1,643 @@
+import os
+import glob
+import time
+import calendar
+import datetime as dt
+from abc import ABC, abstractmethod
+import global_settings as gs
+import bloom_filter as bf
+
+
+def partition_name(date, secao):
+    """
+    Return the name (str) of the partition of the captured URLs
+    registry that holds the articles published on `date` (str in
+    the format %Y-%m-%d) in the DOU section `secao`.
+    """
+    return date + '_s' + str(secao)
+
+
+def partition_date(partition):
+    """
+    Return the publication date (datetime) of the articles in the
+    registry partition named `partition` (str).
+    """
+    return dt.datetime.strptime(partition.split('_')[0], '%Y-%m-%d')
+
+
+def url_file_partition(url_file):
+    """
+    Return the registry partition (str) of the article described by
+    `url_file` (a dict created by get_articles_url.build_url_files).
+    """
+    return partition_name(url_file['date'], url_file['secao'])
+
+
+class URLRegistry(ABC):
+    """
+    Registry of captured URLs, kept in memory as a set so membership
+    tests take constant time. New URLs are buffered and written to the
+    storage in bulk, once `flush_size` URLs are waiting or `flush_interval`
+    seconds passed since the last write, and always when `flush` is called
+    (or when leaving a `with` block). If the capture crashes, at most the
+    buffered URLs are lost, and those articles are captured again.
+
+    If a `bloom` filter (see bloom_filter) is given, the stored URLs are
+    only added to it and the exact set is not kept in memory. Lookups of
+    new URLs are then mostly answered by the filter alone; the URLs that
+    the filter flags as possibly registered are checked exactly by 
+    `contains_many` with one pass over the storage, so memory stays 
+    bounded (single lookups with `in` load the exact set the first time 
+    they need it). Lookup statistics are available from `bloom_stats`.
+
+    Subclasses implement the storage (the abstract methods `read_all`, 
+    `read_partition`, `write`, `clear` and `expire`, so a backend missing
+    one of them cannot be instantiated). Partitioned subclasses only load
+    the partitions requested with `load_partitions`.
+    """
+
+    partitioned = False
+
+    def __init__(self, flush_size=1, flush_interval=None, bloom=None):
+        """
+        Start the registry, loading the already captured URLs if the
+        registry is not partitioned.
+        """
+        self.urls           = set() if bloom is None else None
+        self.bloom          = bloom
+        self.stats          = {'lookups': 0, 'bloom_negatives': 0, 'false_positives': 0}
+        self.loaded         = set()
+        self.pending        = []
+        self.flush_size     = flush_size
+        self.flush_interval = flush_interval
+        self.last_flush     = time.time()
+        if not self.partitioned:
+            self.load_urls(self.read_all())
+
+    def __contains__(self, url):
+        if self.bloom is None:
+            return url in self.urls
+
+        self.stats['lookups'] = self.stats['lookups'] + 1
+        if url not in self.bloom:
+            self.stats['bloom_negatives'] = self.stats['bloom_negatives'] + 1
+            return False
+        if url in self.exact_urls():
+            return True
+        self.stats['false_positives'] = self.stats['false_positives'] + 1
+        return False
+
+    def __len__(self):
+        return len(self.exact_urls())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def load_urls(self, urls):
+        """
+        Add the stored `urls` (iterable) to the exact set (if loaded)
+        and to the bloom filter (if used).
+        """
+        if self.bloom is None:
+            self.urls.update(urls)
+            return
+        if self.urls != None:
+            urls = list(urls)
+            self.urls.update(urls)
+        for url in urls:
+            self.bloom.add(url)
+
+    def read_loaded(self):
+        """
+        Generator of the stored URLs (only from loaded partitions, if the
+        registry is partitioned).
+        """
+        if self.partitioned:
+            for partition in list(self.loaded):
+                for url in self.read_partition(partition):
+                    yield url
+        else:
+            for url in self.read_all():
+                yield url
+
+    def exact_urls(self):
+        """
+        Return the set of registered URLs, loading it from the storage
+        if needed.
+        """
+        if self.urls is None:
+            self.urls = set(self.read_loaded())
+            self.urls.update([url for url, partition in self.pending])
+        return self.urls
+
+    def contains_many(self, urls):
+        """
+        Return a list of booleans telling if each URL in the list `urls`
+        is registered. With a bloom filter and no exact set in memory, the
+        URLs that pass the filter are checked with a single pass over the 
+        storage.
+        """
+        if self.bloom is None or self.urls != None:
+            return [url in self for url in urls]
+
+        # Bloom filter:
+        self.stats['lookups'] = self.stats['lookups'] + len(urls)
+        maybe = set([url for url in urls if url in self.bloom])
+        self.stats['bloom_negatives'] = self.stats['bloom_negatives'] + len(urls) - len(maybe)
+        
+        # Exact check of possibly registered URLs:
+        found = set()
+        if len(maybe) > 0:
+            found = set([url for url, partition in self.pending if url in maybe])
+            for url in self.read_loaded():
+                if url in maybe:
+                    found.add(url)
+        self.stats['false_positives'] = self.stats['false_positives'] + len(maybe - found)
+        
+        return [url in found for url in urls]
+
+    def bloom_stats(self):
+        """
+        Return a dict with the number of lookups, the number of them
+        answered by the bloom filter alone ('bloom_negatives') and the
+        number of false positives, along with the hit rate (fraction of
+        lookups answered by the filter alone), the false positive rate 
+        (among URLs not registered) and the filter's memory (in bytes).
+        """
+        stats = dict(self.stats)
+        if self.bloom is None:
+            return stats
+        # Lookups of URLs that were not registered:
+        new_urls = stats['bloom_negatives'] + stats['false_positives']
+        stats['bloom_hit_rate']      = stats['bloom_negatives'] / stats['lookups'] if stats['lookups'] > 0 else None
+        stats['false_positive_rate'] = stats['false_positives'] / new_urls if new_urls > 0 else None
+        stats['bloom_memory'] = self.bloom.memory()
+        return stats
+
+    def load_partitions(self, partitions):
+        """
+        Load the URLs in the registry `partitions` (iterable of str) that
+        were not loaded yet. Does nothing if the registry is not 
+        partitioned.
+        """
+        if not self.partitioned:
+            return
+        for partition in partitions:
+            if partition not in self.loaded:
+                self.load_urls(self.read_partition(partition))
+                self.loaded.add(partition)
+
+    def add(self, url, partition=None):
+        """
+        Register the `url` (str) as captured, in the registry `partition`
+        (str, only used if the registry is partitioned). It is written to
+        the storage on the next flush.
+        """
+        # PS: URLs are not checked against the storage if its exact set 
+        # is not in memory (registering a URL twice is harmless):
+        if self.urls != None and url in self.urls:
+            return
+        self.remember(url)
+        self.pending.append((url, partition))
+
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+        elif self.flush_interval != None and time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def remember(self, url):
+        """
+        Add a new `url` to the exact set (if loaded) and to the bloom
+        filter (if used).
+        """
+        if self.urls != None:
+            self.urls.add(url)
+        if self.bloom != None:
+            self.bloom.add(url)
+
+    def add_many(self, urls, partition=None):
+        """
+        Register all URLs in the list `urls` as captured, in the registry
+        `partition`, writing them to the storage at once.
+        """
+        for url in urls:
+            if self.urls is None or url not in self.urls:
+                self.remember(url)
+                self.pending.append((url, partition))
+        self.flush()
+
+    def flush(self):
+        """
+        Write the buffered URLs to the storage.
+        """
+        if len(self.pending) > 0:
+            if gs.debug:
+                print('Registering ' + str(len(self.pending)) + ' captured URLs...')
+            self.write(self.pending)
+            self.pending = []
+        self.last_flush = time.time()
+
+    def erase(self):
+        """
+        Erase all registered URLs (including the buffered ones).
+        """
+        self.clear()
+        self.urls    = set() if self.bloom is None else None
+        self.loaded  = set()
+        self.pending = []
+        if self.bloom != None:
+            self.bloom = bf.BloomFilter(self.bloom.capacity, self.bloom.error_rate)
+
+    @abstractmethod
+    def read_all(self):
+        """
+        Return the list of all URLs in the storage.
+        """
+
+    @abstractmethod
+    def read_partition(self, partition):
+        """
+        Return the list of URLs in the storage's `partition` (str).
+        """
+
+    @abstractmethod
+    def write(self, entries):
+        """
+        Store the URLs in `entries` (list of tuples (url, partition)).
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Delete all URLs in the storage.
+        """
+
+    @abstractmethod
+    def expire(self, before_date):
+        """
+        Drop the partitions of articles published before `before_date` 
+        (datetime).
+        """
+
+
+class LocalURLRegistry(URLRegistry):
+    """
+    Registry of captured URLs stored in a local file (one URL per line,
+    appended as they are captured).
+    """
+
+    def __init__(self, filename, flush_size=1, flush_interval=None, bloom=None):
+        """
+        Load the URLs in the file `filename` (str). If the file
+        does not exist, the registry starts empty.
+        """
+        self.filename = filename
+        URLRegistry.__init__(self, flush_size, flush_interval, bloom)
+
+    def read_all(self):
+        """
+        Generator of the URLs in the file (read line by line).
+        """
+        if os.path.isfile(self.filename) == False:
+            return
+        with open(self.filename, 'r') as f:
+            for line in f:
+                yield line.rstrip('\r\n')
+
+    def read_partition(self, partition):
+        """
+        Return the URLs in the file (the registry has a single partition).
+        """
+        return self.read_all()
+
+    def write(self, entries):
+        """
+        Append the URLs in `entries` (list of tuples (url, partition))
+        to the file, with a single write.
+        """
+        with open(self.filename, 'a') as f:
+            f.write(''.join([url + '\n' for url, partition in entries]))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        """
+        Erase the content of the file.
+        """
+        with open(self.filename, 'w') as f:
+            f.write('')
+
+    def expire(self, before_date):
+        raise Exception('LocalURLRegistry: URLs are not stored by date (use erase or url_list_partitioned).')
+
+
+class LocalPartitionedURLRegistry(URLRegistry):
+    """
+    Registry of captured URLs stored in a local directory, with one file
+    per partition (publication date and section) named <partition>.txt
+    (one URL per line, appended as they are captured).
+    """
+
+    partitioned = True
+
+    def __init__(self, path, flush_size=1, flush_interval=None, bloom=None):
+        """
+        Open the registry stored in the directory `path` (str), creating
+        it if needed. No partition is loaded.
+        """
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        URLRegistry.__init__(self, flush_size, flush_interval, bloom)
+
+    def partition_filename(self, partition):
+        return os.path.join(self.path, partition + '.txt')
+
+    def read_all(self):
+        """
+        Return the list of URLs in all partitions.
+        """
+        files = sorted(glob.glob(os.path.join(self.path, '*.txt')))
+        return [url for filename in files for url in self.read_partition(os.path.basename(filename)[:-len('.txt')])]
+
+    def read_partition(self, partition):
+        """
+        Return the list of URLs in `partition` (str).
+        """
+        filename = self.partition_filename(partition)
+        if os.path.isfile(filename) == False:
+            return []
+        with open(filename, 'r') as f:
+            return f.read().splitlines()
+
+    def write(self, entries):
+        """
+        Append the URLs in `entries` (list of tuples (url, partition))
+        to their partitions' files, with a single write per partition.
+        """
+        by_partition = {}
+        for url, partition in entries:
+            by_partition.setdefault(partition, []).append(url)
+        for partition, urls in by_partition.items():
+            with open(self.partition_filename(partition), 'a') as f:
+                f.write(''.join([url + '\n' for url in urls]))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear(self):
+        """
+        Delete all partitions.
+        """
+        for filename in glob.glob(os.path.join(self.path, '*.txt')):
+            os.remove(filename)
+
+    def expire(self, before_date):
+        """
+        Delete the partitions of articles published before `before_date`
+        (datetime).
+        """
+        for filename in glob.glob(os.path.join(self.path, '*.txt')):
+            partition = os.path.basename(filename)[:-len('.txt')]
+            if partition_date(partition) < before_date:
+                os.remove(filename)
+                self.loaded.discard(partition)
+
+
+class AWSURLRegistry(URLRegistry):
+    """
+    Registry of captured URLs stored in an AWS DynamoDB table (one item
+    per URL, with the URL under the key 'url').
+    """
+
+    def __init__(self, table_name, flush_size=1, flush_interval=None, endpoint_url=None, bloom=None):
+        """
+        Load the URLs in the DynamoDB table `table_name` (str). An
+        `endpoint_url` (str) can be given to use another DynamoDB
+        service (e.g. DynamoDB Local, for testing).
+        """
+        import boto3
+        dynamodb   = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+        self.table = dynamodb.Table(table_name)
+        URLRegistry.__init__(self, flush_size, flush_interval, bloom)
+
+    def scan(self):
+        """
+        Return all items in the table (following pagination if necessary).
+        """
+        response = self.table.scan()
+        data = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            data.extend(response['Items'])
+        return data
+
+    def read_all(self):
+        """
+        Return the list of URLs in the table.
+        """
+        return [item['url'] for item in self.scan()]
+
+    def read_partition(self, partition):
+        """
+        Return the list of URLs in the table (the registry has a single 
+        partition).
+        """
+        return self.read_all()
+
+    def write(self, entries):
+        """
+        Put the URLs in `entries` (list of tuples (url, partition)) in
+        the table, with a single batch writer.
+        """
+        with self.table.batch_writer() as batch:
+            for url, partition in entries:
+                batch.put_item(Item={'url': url})
+
+    def clear(self):
+        """
+        Delete all items in the table.
+        """
+        with self.table.batch_writer() as batch:
+            for each in self.scan():
+                batch.delete_item(Key=each)
+
+    def expire(self, before_date):
+        raise Exception('AWSURLRegistry: URLs are not stored by date (use erase or url_list_partitioned).')
+
+
+class AWSPartitionedURLRegistry(URLRegistry):
+    """
+    Registry of captured URLs stored in an AWS DynamoDB table with
+    partition key 'partition' (publication date and section) and sort
+    key 'url'. Unless `keep_days` is None, each item has an 'expires_at'
+    attribute (epoch seconds) set to `keep_days` days after its
+    publication date or, if it is registered later (e.g. in backfills),
+    after the day it is registered, so the table's TTL (if enabled on that
+    attribute) deletes old partitions only once the captures no longer
+    look at them. With `keep_days` None, the items never expire.
+    """
+
+    partitioned = True
+
+    def __init__(self, table_name, flush_size=1, flush_interval=None, endpoint_url=None, keep_days=7, bloom=None):
+        """
+        Open the DynamoDB table `table_name` (str). No partition is
+        loaded. See AWSURLRegistry for `endpoint_url`.
+        """
+        import boto3
+        dynamodb       = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+        self.table     = dynamodb.Table(table_name)
+        self.keep_days = keep_days
+        URLRegistry.__init__(self, flush_size, flush_interval, bloom)
+
+    def read_all(self):
+        """
+        Return the list of URLs in all partitions (following pagination if
+        necessary).
+        """
+        response = self.table.scan()
+        data = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            data.extend(response['Items'])
+        return [item['url'] for item in data]
+
+    def read_partition(self, partition):
+        """
+        Return the list of URLs in `partition` (str), following
+        pagination if necessary.
+        """
+        from boto3.dynamodb.conditions import Key
+        response = self.table.query(KeyConditionExpression=Key('partition').eq(partition))
+        data = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = self.table.query(KeyConditionExpression=Key('partition').eq(partition),
+                                        ExclusiveStartKey=response['LastEvaluatedKey'])
+            data.extend(response['Items'])
+        return [item['url'] for item in data]
+
+    def expires_at(self, partition):
+        """
+        Return the time (epoch seconds) when the items in `partition`
+        (str) registered now should expire.
+        """
+        # Today in Brasilia (UTC-3):
+        today = (dt.datetime.utcnow() - dt.timedelta(hours=3)).replace(hour=0, minute=0, second=0, microsecond=0)
+        expire_date = max(partition_date(partition), today) + dt.timedelta(days=self.keep_days + 1)
+        return calendar.timegm(expire_date.timetuple())
+
+    def write(self, entries):
+        """
+        Put the URLs in `entries` (list of tuples (url, partition)) in
+        the table, with a single batch writer.
+        """
+        with self.table.batch_writer() as batch:
+            for url, partition in entries:
+                item = {'partition': partition, 'url': url}
+                if self.keep_days != None:
+                    item['expires_at'] = self.expires_at(partition)
+                batch.put_item(Item=item)
+
+    def clear(self):
+        """
+        Delete all items in the table.
+        """
+        response = self.table.scan()
+        with self.table.batch_writer() as batch:
+            while True:
+                for each in response['Items']:
+                    batch.delete_item(Key={'partition': each['partition'], 'url': each['url']})
+                if 'LastEvaluatedKey' not in response:
+                    break
+                response = self.table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+
+    def expire(self, before_date):
+        """
+        Forget the loaded partitions of articles published before 
+        `before_date` (datetime). They are deleted from the table by 
+        DynamoDB's TTL.
+        """
+        for partition in list(self.loaded):
+            if partition_date(partition) < before_date:
+                self.loaded.discard(partition)
+
+
+def open_registry(url_list, flush_size=1, flush_interval=None, endpoint_url=None, partitioned=False, keep_days=7,
+                  bloom_error_rate=None, bloom_capacity=1000000):
+    """
+    Return the registry of captured URLs stored in `url_list` (str), which
+    is either a local file or an AWS DynamoDB table name (according to
+    global variable gs.local). Registered URLs are written in batches of
+    `flush_size` or every `flush_interval` seconds (see URLRegistry).
+    `endpoint_url` is only used for DynamoDB (see AWSURLRegistry).
+
+    If `partitioned` is True, the URLs are stored by publication date
+    and section (`url_list` is then a local directory or a DynamoDB table
+    with keys 'partition' and 'url') and, in DynamoDB, partitions expire
+    after `keep_days` days (never, if `keep_days` is None).
+
+    If `bloom_error_rate` (float) is given, lookups go through a bloom 
+    filter with that false positive rate, sized for `bloom_capacity` URLs.
+    """
+    bloom = None if bloom_error_rate is None else bf.BloomFilter(bloom_capacity, bloom_error_rate)
+    if gs.local:
+        if partitioned:
+            return LocalPartitionedURLRegistry(url_list, flush_size, flush_interval, bloom)
+        return LocalURLRegistry(url_list, flush_size, flush_interval, bloom)
+    else:
+        if partitioned:
+            return AWSPartitionedURLRegistry(url_list, flush_size, flush_interval, endpoint_url, keep_days, bloom)
+        return AWSURLRegistry(url_list, flush_size, flush_interval, endpoint_url, bloom)
+
+
+def open_config_registry(config):
+    """
+    Return the registry of captured URLs specified by the keys in the
+    `config` (dict):
+    * url_list:                filename or DynamoDB table name;
+    * registry_flush_size:     number of URLs buffered before writing them (optional, default 50);
+    * registry_flush_interval: maximum number of seconds between writes (optional, default 60);
+    * dynamodb_endpoint:       URL of the DynamoDB service (optional, default AWS);
+    * url_list_partitioned:    whether to store URLs by publication date and section (optional, default False);
+    * url_list_keep_days:      number of days to keep each partition (optional, default 7; at least
+                               -timedelta days are kept, as in get_articles_url.update_config);
+    * daily_clean_url_list:    whether old partitions are dropped at all (optional, default False; in
+                               DynamoDB, the items only get an expiry time if this is True);
+    * registry_bloom_error_rate: false positive rate of a bloom filter in front of the registry 
+                                 (optional, default: no bloom filter);
+    * registry_bloom_capacity: number of URLs the bloom filter is sized for (optional, default 1000000).
+    """
+    if config.get('daily_clean_url_list', False):
+        keep_days = max(config.get('url_list_keep_days', 7), -config.get('timedelta', 0))
+    else:
+        keep_days = None
+    return open_registry(config['url_list'], config.get('registry_flush_size', 50),
+                         config.get('registry_flush_interval', 60), config.get('dynamodb_endpoint'),
+                         config.get('url_list_partitioned', False), keep_days,
+                         config.get('registry_bloom_error_rate'), config.get('registry_bloom_capacity', 1000000))
+
+
+def register_url_file(registry, url_file):
+    """
+    Register the URL of the article described by `url_file` (a dict
+    created by get_articles_url.build_url_files) in the `registry`,
+    under its partition if the registry is partitioned.
+    """
+    partition = url_file_partition(url_file) if registry.partitioned else None
+    registry.add(url_file['url'], partition)
+
+
+def filter_new(registry, url_files):
+    """
+    Given a `registry` of captured URLs and a list of dicts `url_files`
+    containing URLs and filenames, return a list of the dicts whose URLs
+    are not registered. If the registry is partitioned, only the
+    partitions of `url_files` are loaded.
+    """
+    if registry.partitioned:
+        registry.load_partitions(set([url_file_partition(d) for d in url_files]))
+    captured = registry.contains_many([d['url'] for d in url_files])
+    return [d for d, c in zip(url_files, captured) if not c]
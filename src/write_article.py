@@ -19,19 +19,19 @@ def last_slash(path):
 
 def get_pub_date(article_raw):
     """
-    Given a list of dicts with key-value pairs 'article_raw' that describe a DOU's article, 
+    Given a RawArticle 'article_raw' (see parse_dou_article) that describes a DOU's article, 
     returns a string that states the article's date of publication. If the hard-coded key 
     is not found, return capture date instead (with the 'capt' prefix).
     """
-    # Find dict in list that contains publication date:
-    pub_date_entry = list(filter(lambda d: d['key']=='publicado-dou-data', article_raw))
+    # Get the publication date:
+    pub_date_entry = article_raw.get('publicado-dou-data')
     
-    if len(pub_date_entry)==0:
+    if pub_date_entry is None:
         # If no publication date was found, use capture date instead
-        pub_date_entry = 'capt_' + article_raw[0]['capture_date'].split()[0]
+        pub_date_entry = 'capt_' + article_raw.capture_date.split()[0]
     else:
         # If it was found, format it to '%Y-%m-%d':
-        pub_date_entry = dt.datetime.strptime(pub_date_entry[0]['value'], '%d/%m/%Y').strftime('%Y-%m-%d')
+        pub_date_entry = dt.datetime.strptime(pub_date_entry, '%d/%m/%Y').strftime('%Y-%m-%d')
     
     return pub_date_entry
 
@@ -40,7 +40,7 @@ def write_local_article(config, article_raw, filename):
     """
     Given the input:
     * config      -- a dict that contains the storage path;
-    * article_raw -- a list of dicts that stores the information in an article;
+    * article_raw -- a RawArticle (see parse_dou_article) that stores the information in an article;
     * filename    -- the name for the article's file.    
     Writes the article as json to a file in a sub-directory given by the publication date, 
     inside the directory given by storage_path in config.
@@ -63,14 +63,14 @@ def write_local_article(config, article_raw, filename):
    
     # dump json to file:
     with open(path + filename, 'w') as f:
-        json.dump(article_raw, f)
+        json.dump(article_raw.rows(), f)
 
 
 def write_to_s3(config, article_raw, filename):
     """
     Given the input:
     * config      -- a dict that contains the S3 bucket and path for the article (key);
-    * article_raw -- a list of dicts that stores the information in an article;
+    * article_raw -- a RawArticle (see parse_dou_article) that stores the information in an article;
     * filename    -- the name for the article's file.    
     It prepares a json ('body') and save it to AWS S3. It returns the S3 
     HTTP status code.
@@ -84,7 +84,7 @@ def write_to_s3(config, article_raw, filename):
     # First it transforms the list of dicts in a list of jsons
     # (json is a string):
     print ('Creating json list...')
-    result = [json.dumps(record, ensure_ascii=False) for record in article_raw] 
+    result = [json.dumps(record, ensure_ascii=False) for record in article_raw.rows()] 
     # Cria um arquivo texto com vários jsons:
     body = '\n'.join(result)
     